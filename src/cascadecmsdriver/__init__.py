@@ -1,5 +1,34 @@
 from .driver import CascadeCMSRestDriver
 from .cmstypes import *
 from .wrapper import CascadeWrapper
+from .crawler import FolderCrawler
+from .resolver import PathResolver
+from .bulk import BulkEditor, EditJournal
+from .throttle import RateLimiter
+from .publishing import PublishScheduler, PublishIntent, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+from .searching import SearchCache, ShardedSearch
+from .executor import SiteExecutor, SharedRateLimiter
+from .dependencies import DependencyIndex
+from .textindex import TextIndex
+from .snapshot import SnapshotIndex, contentHash, iterSnapshot
+from .export import SiteExporter
+from .diff import SnapshotDiff
+from .importer import SnapshotImporter
+from .cache import ResponseCache
+from .warmup import CacheWarmer
+from .changefeed import ChangeFeed, ChangeEvent
+from .workflows import WorkflowResolver
+from .accessrights import AccessRightsScanner
+from .lanes import PriorityLanes, LANE_INTERACTIVE, LANE_BULK, LANE_BACKGROUND
+from .pipeline import Pipeline, Stage, readStage, editStage, publishStage
 
-__all__ = ["CascadeCMSRestDriver", "CascadeWrapper"]
\ No newline at end of file
+__all__ = ["CascadeCMSRestDriver", "CascadeWrapper", "FolderCrawler", "BulkEditor", "EditJournal",
+           "Pipeline", "Stage", "readStage", "editStage", "publishStage",
+           "RateLimiter", "PublishScheduler", "PublishIntent", "PRIORITY_HIGH", "PRIORITY_NORMAL", "PRIORITY_LOW",
+           "SearchCache", "ShardedSearch", "PathResolver",
+           "SiteExecutor", "SharedRateLimiter", "DependencyIndex", "TextIndex",
+           "SiteExporter", "iterSnapshot", "SnapshotImporter",
+           "SnapshotIndex", "contentHash", "SnapshotDiff",
+           "ResponseCache", "CacheWarmer", "ChangeFeed", "ChangeEvent",
+           "WorkflowResolver", "AccessRightsScanner",
+           "PriorityLanes", "LANE_INTERACTIVE", "LANE_BULK", "LANE_BACKGROUND"]
\ No newline at end of file
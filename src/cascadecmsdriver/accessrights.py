@@ -0,0 +1,261 @@
+""" Access rights for a whole folder tree. Reads the ACL of every folder (and,
+optionally, every asset) concurrently once, keeps each distinct ACL only once,
+exports a principal x asset permission matrix and plans the smallest set of
+editAccessRights calls that reaches a target state. """
+
+import csv
+import json
+from concurrent.futures import ThreadPoolExecutor
+from .cmstypes import AccessRightsInformation, AclEntry, CascadeIdentifier
+from .crawler import FolderCrawler, matchesType, unwrapAsset
+from .lanes import carryLane
+
+LEVELS = ('none', 'read', 'write')
+# matrix column for the level granted to everyone (allLevel)
+ALL = 'all'
+
+
+def aclKey(acl):
+    """ Order-independent key of an ACL given as a readAccessRights accessRightsInformation,
+    an AccessRightsInformation or a {'allLevel', 'aclEntries'} dict. """
+    if isinstance(acl, AccessRightsInformation):
+        acl = json.loads(acl.toJson())
+    entries = sorted((e['type'], e['name'], e['level']) for e in acl.get('aclEntries') or [])
+    return acl.get('allLevel') or 'none', tuple(entries)
+
+
+def _strongest(*levels):
+    return max(levels, key=LEVELS.index)
+
+
+class AccessRightsScanner:
+    """
+    Usage:
+        rights = AccessRightsScanner(driver).scan(CascadeIdentifier('site', siteId))
+        rights.acl(assetId)                       # {'allLevel', 'aclEntries'}
+        rights.levelOf(assetId, 'group:Editors')  # 'none', 'read' or 'write'
+        rights.overrides()                        # assets whose ACL differs from their folder's
+        rights.writeMatrix('acl.csv')             # or acl.json for the compact form
+        plan = rights.planAcl(lambda assetId, acl: ...)
+        rights.apply(plan)                        # or apply(plan, dryRun=True)
+
+    Every distinct ACL is stored once in `acls` and assets point at it by index,
+    so a tree where most assets share their folder's ACL costs one entry per
+    ACL, not per asset. With readLeaves=False only folders are read and every
+    other asset is assumed to carry its folder's ACL, which is what
+    editAccessRights with applyToChildren leaves behind.
+    """
+
+    def __init__(self, driver, types=(), readLeaves=True, maxWorkers=8):
+        self._driver = driver
+        self.types = tuple(types)
+        self.readLeaves = readLeaves
+        self.maxWorkers = maxWorkers
+        self.acls = []
+        self.assigned = {}
+        self.assets = {}
+        self.parents = {}
+        self.children = {}
+        # folders with children left out of the scan by `types`
+        self.unscanned = set()
+        self.root = None
+        self._index = {}
+
+    def _intern(self, acl):
+        key = aclKey(acl)
+        if key not in self._index:
+            self._index[key] = len(self.acls)
+            self.acls.append({'allLevel': key[0],
+                              'aclEntries': [{'type': t, 'name': n, 'level': l} for t, n, l in key[1]]})
+        return self._index[key]
+
+    def _readAcl(self, assetId):
+        asset = self.assets[assetId]
+        response = self._driver.readAccessRights(CascadeIdentifier(type=asset['type'], id=assetId))
+        info = (response or {}).get('accessRightsInformation')
+        if info is None:
+            self._driver.error(f"Could not read access rights of {asset['type']} {asset['path']}: {(response or {}).get('message')}")
+        return assetId, info
+
+    def scan(self, root):
+        """ Reads the ACLs of `root` (folder or site) and everything below it. """
+        if isinstance(root, dict):
+            root = CascadeIdentifier(type=root['type'], id=root['id'])
+        rootId = root.id
+        if root.type == 'site':
+            rootId = (unwrapAsset(self._driver.read(root))[1] or {}).get('rootFolderId')
+        rootFolder = unwrapAsset(self._driver.read(CascadeIdentifier(type='folder', id=rootId)))[1] or {}
+        self.root = rootId
+        rootPath = rootFolder.get('path') or '/'
+        byPath = {rootPath: rootId, rootPath.strip('/'): rootId}
+        self.assets = {rootId: {'type': 'folder', 'path': rootPath}}
+        self.parents = {rootId: None}
+        self.children = {rootId: []}
+        self.unscanned = set()
+        crawler = FolderCrawler(self._driver, maxWorkers=self.maxWorkers)
+        # crawl yields each level after its parents, so every parent path is already known
+        for record in crawler.crawl(CascadeIdentifier(type='folder', id=rootId)):
+            path = (record.get('path') or {}).get('path', '')
+            parentId = byPath.get(path.rsplit('/', 1)[0] if '/' in path else '', rootId)
+            if record['type'] != 'folder' and not matchesType(record['type'], self.types):
+                self.unscanned.add(parentId)
+                continue
+            if record['type'] == 'folder':
+                byPath[path] = record['id']
+                self.children.setdefault(record['id'], [])
+            self.assets[record['id']] = {'type': record['type'], 'path': path}
+            self.parents[record['id']] = parentId
+            self.children.setdefault(parentId, []).append(record['id'])
+        toRead = [a for a, asset in self.assets.items() if self.readLeaves or asset['type'] == 'folder']
+        self.acls, self._index, self.assigned = [], {}, {}
+        with ThreadPoolExecutor(max_workers=self.maxWorkers) as pool:
+            for assetId, info in pool.map(carryLane(self._driver, self._readAcl), toRead):
+                if info is not None:
+                    self.assigned[assetId] = self._intern(info)
+        if not self.readLeaves:
+            # walked top-down, so every asset's folder already has its ACL
+            for assetId in self._topDown():
+                parentId = self.parents[assetId]
+                if assetId not in self.assigned and parentId in self.assigned:
+                    self.assigned[assetId] = self.assigned[parentId]
+        self._driver.info(f'Scanned access rights of {len(self.assigned)} assets ({len(toRead)} reads), '
+                          f'{len(self.acls)} distinct ACLs')
+        return self
+
+    def _topDown(self):
+        order, stack = [], [self.root]
+        while stack:
+            assetId = stack.pop()
+            order.append(assetId)
+            stack.extend(reversed(self.children.get(assetId, [])))
+        return order
+
+    def acl(self, assetId):
+        index = self.assigned.get(assetId)
+        return None if index is None else self.acls[index]
+
+    def principals(self):
+        """ Every user and group named in any ACL, as 'user:name' / 'group:name'. """
+        return sorted({f"{e['type']}:{e['name']}" for acl in self.acls for e in acl['aclEntries']})
+
+    def levelOf(self, assetId, principal):
+        """ Level `principal` ('user:name', 'group:name' or 'all') has on the asset, counting
+        the level granted to everyone. Group memberships of users are not expanded. """
+        acl = self.acl(assetId)
+        if acl is None:
+            return None
+        levels = [acl['allLevel']] + [e['level'] for e in acl['aclEntries'] if f"{e['type']}:{e['name']}" == principal]
+        return _strongest(*levels)
+
+    def overrides(self):
+        """ Assets whose ACL differs from their folder's, i.e. where inheritance was broken. """
+        return [a for a in self._topDown() if self.parents.get(a) is not None and a in self.assigned and
+                self.assigned[a] != self.assigned.get(self.parents[a])]
+
+    def matrix(self):
+        """ (columns, rows): one row per distinct ACL, a column per principal plus 'all'. """
+        columns = [ALL] + self.principals()
+        rows = []
+        for acl in self.acls:
+            entries = {f"{e['type']}:{e['name']}": e['level'] for e in acl['aclEntries']}
+            rows.append([acl['allLevel']] + [_strongest(acl['allLevel'], entries.get(p, 'none')) for p in columns[1:]])
+        return columns, rows
+
+    def writeMatrix(self, path):
+        """ Writes one CSV row per asset for '.csv' paths, otherwise the compact JSON form:
+        the distinct ACL rows once, and every asset as [id, type, path, row index]. """
+        columns, rows = self.matrix()
+        assets = [(a, self.assets[a]['type'], self.assets[a]['path'], self.assigned[a])
+                  for a in self._topDown() if a in self.assigned]
+        if str(path).endswith('.csv'):
+            with open(path, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['id', 'type', 'path', 'acl'] + columns)
+                for assetId, assetType, assetPath, index in assets:
+                    writer.writerow([assetId, assetType, assetPath, index] + rows[index])
+        else:
+            with open(path, 'w') as f:
+                json.dump({'columns': columns, 'acls': rows, 'assets': [list(a) for a in assets]}, f)
+        return len(assets)
+
+    def planAcl(self, target):
+        """
+        Fewest editAccessRights calls that leave every asset with the target ACL.
+        `target` is an ACL ({'allLevel', 'aclEntries'} or AccessRightsInformation)
+        or a callable (assetId, acl) -> ACL, returning None to keep the current
+        one. A call sets one asset or, with applyToChildren on a folder, its
+        whole subtree; the plan is found with a dynamic program over the tree,
+        as in WorkflowResolver.planSetting. Returns steps in top-down order.
+
+        A folder is never pushed to when anything below it is unknown: assets
+        left out by `types` or whose ACL could not be read would be overwritten
+        unseen, so the assets under such a folder are set one by one.
+        """
+        topDown = self._topDown()
+        blocked = set()
+        for assetId in reversed(topDown):
+            if assetId not in self.assigned or assetId in self.unscanned or \
+                    any(k in blocked for k in self.children.get(assetId, ())):
+                blocked.add(assetId)
+        if blocked:
+            self._driver.info(f'{len(blocked)} assets have unscanned or unread assets in or below them '
+                              f'and are never pushed to')
+        order = [a for a in topDown if a in self.assigned]
+        wanted = {}
+        for assetId in order:
+            acl = target(assetId, self.acl(assetId)) if callable(target) else target
+            wanted[assetId] = self.assigned[assetId] if acl is None else self._intern(acl)
+        states = [None] + sorted(set(wanted.values()))
+        # cost[a][state]: edits needed under a when the nearest ACL pushed down above it is `state`
+        cost = {}
+        for assetId in reversed(order):
+            kids = [k for k in self.children.get(assetId, []) if k in cost]
+            cost[assetId] = {}
+            for state in states:
+                value = self.assigned[assetId] if state is None else state
+                keep = (value != wanted[assetId]) + sum(cost[k][state][0] for k in kids)
+                push = 1 + sum(cost[k][wanted[assetId]][0] for k in kids)
+                if self.assets[assetId]['type'] == 'folder' and kids and push < keep and assetId not in blocked:
+                    cost[assetId][state] = (push, 'push')
+                else:
+                    cost[assetId][state] = (keep, 'set' if value != wanted[assetId] else None)
+        plan = []
+        stack = [(self.root, None)] if self.root in cost else []
+        while stack:
+            assetId, state = stack.pop()
+            _, action = cost[assetId][state]
+            if action is not None:
+                plan.append({'id': assetId, 'type': self.assets[assetId]['type'], 'path': self.assets[assetId]['path'],
+                             'acl': self.acls[wanted[assetId]], 'applyToChildren': action == 'push'})
+            childState = wanted[assetId] if action == 'push' else state
+            stack.extend((k, childState) for k in reversed(self.children.get(assetId, [])) if k in cost)
+        return plan
+
+    def apply(self, plan, dryRun=False):
+        """ Runs the plan's editAccessRights calls in order, parents before children. """
+        results = []
+        for step in plan:
+            info = AccessRightsInformation(CascadeIdentifier(type=step['type'], id=step['id']),
+                                           [AclEntry.fromJson(e) for e in step['acl']['aclEntries']],
+                                           step['acl']['allLevel'])
+            if dryRun:
+                results.append({'id': step['id'], 'path': step['path'], 'payload': json.loads(info.toJson()),
+                                'applyToChildren': step['applyToChildren']})
+                continue
+            response = self._driver.editAccessRights(info, applyToChildren=step['applyToChildren'])
+            results.append({'id': step['id'], 'path': step['path'], 'response': response})
+            if response and response.get('success') in (True, 'true'):
+                self._record(step)
+            else:
+                self._driver.error(f"Editing access rights of {step['path']} failed: {(response or {}).get('message')}")
+        return results
+
+    def _record(self, step):
+        """ Mirrors a successful edit in the local state so later queries stay correct. """
+        index = self._intern(step['acl'])
+        stack = [step['id']]
+        while stack:
+            assetId = stack.pop()
+            self.assigned[assetId] = index
+            if step['applyToChildren']:
+                stack.extend(self.children.get(assetId, []))
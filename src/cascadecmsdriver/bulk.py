@@ -0,0 +1,182 @@
+""" Bulk read -> transform -> edit engine with a local checkpoint journal so an
+interrupted job resumes where it stopped instead of starting over. """
+
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from .cmstypes import CascadeIdentifier, SearchInformation
+from .crawler import FolderCrawler, unwrapAsset
+from .lanes import carryLane
+from .snapshot import VOLATILE
+
+
+def _editHash(asset):
+    """ Hash of everything an edit can change; server-maintained dates are left out. """
+    stable = {k: v for k, v in asset.items() if k not in VOLATILE}
+    return hashlib.sha256(json.dumps(stable, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+
+class EditJournal:
+    """
+    Append-only JSON lines journal of per-asset progress. The last state
+    recorded for an asset wins, so the file can be replayed after a crash.
+    A 'started' entry carries hashes of the asset before and after the
+    intended edit, so a resumed job can tell whether that edit landed.
+    """
+    FINISHED = ('done', 'unchanged', 'skipped')
+
+    def __init__(self, path):
+        self.path = path
+        self.states = {}
+        self.entries = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # a torn final line from a crash; everything before it is intact
+                        continue
+                    self.states[entry['key']] = entry['state']
+                    self.entries[entry['key']] = entry
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, 'a')
+
+    @staticmethod
+    def key(identifier):
+        return f'{identifier.type}:{identifier.id}'
+
+    def isFinished(self, identifier):
+        return self.states.get(self.key(identifier)) in EditJournal.FINISHED
+
+    def record(self, identifier, state, message=None, **details):
+        entry = dict(details, key=self.key(identifier), state=state)
+        if message:
+            entry['message'] = message
+        with self._lock:
+            self.states[entry['key']] = state
+            self.entries[entry['key']] = entry
+            self._file.write(json.dumps(entry) + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+class BulkEditor:
+    """
+    Applies a transform to every asset produced by a selector with bounded
+    concurrency. The selector may be a SearchInformation, a folder or site
+    CascadeIdentifier to crawl, or an iterable of identifiers / identifier dicts.
+
+    The transform receives the asset dict (e.g. response['asset']['page']) and
+    returns the edited dict, or None to skip the asset. Assets whose transform
+    leaves them unchanged are never written, so re-running an idempotent
+    transform over an asset that was edited just before a crash does not
+    produce a duplicate write.
+
+    An asset whose edit was interrupted or failed is read again on resume: if it already matches the intended edit it is counted
+    as done, if it still matches the original it is edited again, and
+    otherwise it is reported as 'uncertain' and left alone, so
+    non-idempotent transforms (append, increment) never apply twice.
+    """
+
+    def __init__(self, driver, journalPath, maxWorkers=4):
+        self._driver = driver
+        self.journal = EditJournal(journalPath)
+        self.maxWorkers = maxWorkers
+
+    def _select(self, selector):
+        if isinstance(selector, SearchInformation):
+            return (m for m in self._driver.search(selector).get('matches', []))
+        if isinstance(selector, (CascadeIdentifier, dict)):
+            selectorType = selector['type'] if isinstance(selector, dict) else selector.type
+            if selectorType in ('folder', 'site'):
+                return FolderCrawler(self._driver, maxWorkers=self.maxWorkers).crawl(selector)
+            return iter([selector])
+        return iter(selector)
+
+    @staticmethod
+    def _toIdentifier(item):
+        if isinstance(item, CascadeIdentifier):
+            return item
+        return CascadeIdentifier(type=item['type'], id=item['id'])
+
+    def _process(self, identifier, transform):
+        response = self._driver.read(identifier)
+        key, asset = unwrapAsset(response)
+        if asset is None:
+            return 'failed', response.get('message', 'read failed')
+        interrupted = self.journal.entries.get(EditJournal.key(identifier), {})
+        if 'after' in interrupted:
+            current = _editHash(asset)
+            if current == interrupted.get('after'):
+                return 'done', 'edit from the interrupted run had been applied'
+            if current != interrupted.get('before'):
+                return 'uncertain', 'changed since the interrupted edit; not edited again'
+        original = json.dumps(asset, sort_keys=True)
+        edited = transform(json.loads(original))
+        if edited is None:
+            return 'skipped', None
+        if json.dumps(edited, sort_keys=True) == original:
+            return 'unchanged', None
+        self.journal.record(identifier, 'started', before=_editHash(asset), after=_editHash(edited))
+        status = self._driver.edit({'asset': {key: edited}})
+        if status.get('success') in (True, 'true'):
+            return 'done', None
+        return 'failed', status.get('message', 'edit failed')
+
+    def run(self, selector, transform, retryFailed=True):
+        """ Runs the job and returns a dict of counts per final state. Assets the
+        journal already finished are skipped; failed ones are retried unless
+        retryFailed is False. Uncertain ones are only reported, once; check them
+        and record them in the journal (or delete it) to process them again. """
+        counts = {'done': 0, 'unchanged': 0, 'skipped': 0, 'failed': 0, 'uncertain': 0, 'resumed': 0}
+        pending = set()
+
+        def finish(future):
+            identifier, (state, message) = future.result()
+            previous = self.journal.entries.get(EditJournal.key(identifier), {})
+            # a failed edit may still have been applied (e.g. a timeout), so the next run checks it too
+            hashes = {k: previous[k] for k in ('before', 'after') if k in previous} if state == 'failed' else {}
+            self.journal.record(identifier, state, message, **hashes)
+            counts[state] += 1
+            if state in ('failed', 'uncertain'):
+                self._driver.error(f'Bulk edit of {identifier.type} {identifier.id} {state}: {message}')
+
+        def work(identifier):
+            try:
+                return identifier, self._process(identifier, transform)
+            except Exception as e:
+                return identifier, ('failed', str(e))
+
+        work = carryLane(self._driver, work)
+        with ThreadPoolExecutor(max_workers=self.maxWorkers) as pool:
+            for item in self._select(selector):
+                identifier = self._toIdentifier(item)
+                previous = self.journal.states.get(EditJournal.key(identifier))
+                if self.journal.isFinished(identifier) or previous == 'uncertain' or (previous == 'failed' and not retryFailed):
+                    counts['resumed'] += 1
+                    continue
+                # keep the number of queued reads bounded for very large selections
+                if len(pending) >= self.maxWorkers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        finish(future)
+                pending.add(pool.submit(work, identifier))
+            for future in wait(pending).done:
+                finish(future)
+        self._driver.info(f'Bulk edit finished: {counts}')
+        return counts
+
+    def close(self):
+        self.journal.close()
@@ -0,0 +1,327 @@
+""" Response cache shared by the sync and async drivers. Decoded JSON bodies are
+stored in SQLite under a key built from the method, URL and normalized body,
+so a read cached by one driver is a hit for the other. """
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from .cmstypes import AuditParameters, CascadeIdentifier
+
+# three days, the policy the sync driver has always used
+DEFAULT_EXPIRE_AFTER = 259200
+# not ./app/cache.sqlite: that file still holds the tables of the requests-cache backend used before
+DEFAULT_CACHE_PATH = './app/responses.sqlite'
+
+_ASSET_URL = re.compile(r'/api/v1/\w+/([^/?]+)/([^/?]+)/?$')
+# write endpoints that add, remove or rename children, so the folders around the asset change too
+_STRUCTURAL_WRITES = ('create', 'copy', 'move', 'delete', 'batch')
+# write endpoint -> (payload flags that push it down to every descendant, read endpoint it changes)
+_SUBTREE_WRITES = {'editAccessRights': (('applyToChildren',), 'readAccessRights'),
+                   'editWorkflowSettings': (('applyInheritWorkflowsToChildren', 'applyRequireWorkflowToChildren'),
+                                            'readWorkflowSettings')}
+
+
+def cacheKey(method: str, url: str, body=None):
+    """ The same request always gives the same key, whichever driver builds it. """
+    if isinstance(body, bytes):
+        body = body.decode('utf-8')
+    if isinstance(body, str):
+        try:
+            body = json.loads(body)
+        except ValueError:
+            pass
+    if body is not None and not isinstance(body, str):
+        body = json.dumps(body, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(f"{method.upper()} {url}\n{body or ''}".encode('utf-8')).hexdigest()
+
+
+def decodeBody(data):
+    """ A request body given as JSON text, bytes or an already decoded object; None when not JSON. """
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    if isinstance(data, str):
+        try:
+            return json.loads(data)
+        except ValueError:
+            return None
+    return data
+
+
+def _assetOf(url, response=None):
+    """ Id of the asset a read returned, so reads by path and by id share it, or
+    of the asset its URL addresses, e.g. .../read/page/<id>. """
+    for value in (response or {}).values():
+        if not isinstance(value, dict):
+            continue
+        # {'asset': {'page': {...}}}, or {'accessRightsInformation': {'identifier': {...}}} and the like
+        inner = next(iter(value.values()), None) if len(value) == 1 else value.get('identifier')
+        if isinstance(inner, dict) and inner.get('id'):
+            return inner['id']
+    match = _ASSET_URL.search(url)
+    return match.group(2) if match else None
+
+
+def writtenAssets(url, data=None):
+    """ Ids a write request changes: the asset in its URL plus every asset, identifier
+    and parent folder or container named in its body (edit and create carry no id in the URL). """
+    ids = set()
+    match = _ASSET_URL.search(url)
+    if match:
+        ids.add(match.group(2))
+    stack = [decodeBody(data)]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, list):
+            stack.extend(value)
+        elif isinstance(value, dict):
+            for key, item in value.items():
+                if key in ('id', 'parentFolderId', 'parentContainerId') and isinstance(item, str) and item:
+                    ids.add(item)
+                elif isinstance(item, (dict, list)):
+                    stack.append(item)
+    return ids
+
+
+class ResponseCache:
+    """
+    Usage:
+        cache = ResponseCache('./app/responses.sqlite', maxBytes=512 * 1024 * 1024).attach(driver)
+        response = cache.get(key)          # None when missing or expired
+        cache.put(key, url, response)
+        cache.stats()                      # entries, bytes, hit ratio, evictions
+
+    Entries expire `expireAfter` seconds after they are stored. Reads are
+    filed under the id of the asset they return, whether they were addressed
+    by id or by path. A write through an attached driver drops the cached
+    reads of every asset named in its URL or body; creates, copies, moves and
+    deletes also drop the folders around them, and access rights or workflow
+    settings pushed down to children drop every cached read of that kind,
+    since the cache cannot tell which assets lie below the folder.
+
+    Safe to share between processes: the database runs in WAL mode so readers
+    never block the writer, every write is its own short transaction, and
+    writers wait on a lock instead of failing. Bodies are zlib-compressed;
+    once the compressed total passes maxBytes, expired entries and then the
+    least recently used ones are evicted down to 90% of the cap.
+
+    Expired entries stay readable through getStale() for `keepStale` seconds
+    so an AuditRevalidator can confirm them with renew() instead of a re-read.
+    """
+    # reads only record their access time when it is older than this, to keep reads from writing
+    TOUCH_RESOLUTION = 60
+    # puts between size checks
+    CHECK_EVERY = 200
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, expireAfter=DEFAULT_EXPIRE_AFTER, maxBytes=512 * 1024 * 1024,
+                 compressLevel=6, keepStale=None):
+        self.path = path
+        self.expireAfter = expireAfter
+        # how long expired entries are kept for revalidation before eviction; one more TTL by default
+        self.keepStale = expireAfter if keepStale is None else keepStale
+        self.revalidated = 0
+        self.bytesSaved = 0
+        self.maxBytes = maxBytes
+        self.compressLevel = compressLevel
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connection() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, url TEXT, asset TEXT, '
+                       'body BLOB, expires REAL, size INTEGER, rawSize INTEGER, accessed REAL, verified REAL)')
+            db.execute('CREATE INDEX IF NOT EXISTS entries_asset ON entries (asset)')
+            db.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)')
+
+    def _connection(self):
+        # sqlite connections cannot be shared between threads
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=30)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute('PRAGMA busy_timeout=30000')
+            # the WAL file is truncated back to this after each checkpoint instead of keeping its peak size
+            db.execute('PRAGMA journal_size_limit=8388608')
+        return db
+
+    def attach(self, driver):
+        driver.writeListeners.append(self.onWrite)
+        return self
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key):
+        now = time.time()
+        row = self._connection().execute('SELECT body, expires, accessed FROM entries WHERE key = ?', (key,)).fetchone()
+        if row is None or row[1] <= now:
+            self._count(False)
+            return None
+        self._count(True)
+        if row[2] < now - ResponseCache.TOUCH_RESOLUTION:
+            with self._connection() as db:
+                db.execute('UPDATE entries SET accessed = ? WHERE key = ?', (now, key))
+        return json.loads(zlib.decompress(row[0]))
+
+    def put(self, key, url, response, expireAfter=None):
+        now = time.time()
+        raw = json.dumps(response, separators=(',', ':')).encode('utf-8')
+        body = zlib.compress(raw, self.compressLevel)
+        expires = now + (self.expireAfter if expireAfter is None else expireAfter)
+        with self._connection() as db:
+            db.execute('INSERT OR REPLACE INTO entries (key, url, asset, body, expires, size, rawSize, accessed, verified) '
+                       'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                       (key, url, _assetOf(url, response), body, expires, len(body), len(raw), now, now))
+        with self._lock:
+            self._puts += 1
+            check = self._puts % ResponseCache.CHECK_EVERY == 0
+        if check:
+            self.evict()
+
+    def getStale(self, key):
+        """ (response, verified) for an expired entry still kept for revalidation, where
+        verified is when the body was last known to be current; otherwise None. """
+        row = self._connection().execute('SELECT body, verified FROM entries WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(zlib.decompress(row[0])), row[1]
+
+    def renew(self, key, expireAfter=None):
+        """ Marks an entry as verified current without downloading it again. """
+        now = time.time()
+        expires = now + (self.expireAfter if expireAfter is None else expireAfter)
+        with self._connection() as db:
+            row = db.execute('SELECT rawSize FROM entries WHERE key = ?', (key,)).fetchone()
+            db.execute('UPDATE entries SET expires = ?, verified = ?, accessed = ? WHERE key = ?', (expires, now, now, key))
+        with self._lock:
+            self.revalidated += 1
+            self.bytesSaved += row[0] if row else 0
+
+    def delete(self, key):
+        with self._connection() as db:
+            db.execute('DELETE FROM entries WHERE key = ?', (key,))
+
+    def onWrite(self, url, data=None):
+        endpoint = url.split('/api/v1/', 1)[-1].split('/', 1)[0]
+        ids = writtenAssets(url, data)
+        db = self._connection()
+        if endpoint in _STRUCTURAL_WRITES:
+            # the folder a moved or deleted asset leaves is only known from its cached read
+            for assetId in list(ids):
+                ids.update(self.parentsOf(assetId))
+        with db:
+            db.executemany('DELETE FROM entries WHERE asset = ?', [(i,) for i in ids])
+            flags, readEndpoint = _SUBTREE_WRITES.get(endpoint, ((), None))
+            payload = decodeBody(data)
+            if isinstance(payload, dict) and any(payload.get(flag) for flag in flags):
+                db.execute('DELETE FROM entries WHERE url LIKE ?', (f'%/api/v1/{readEndpoint}/%',))
+
+    def parentsOf(self, assetId):
+        """ Ids of the folder or container an asset sat in according to its cached reads. """
+        parents = set()
+        for body, in self._connection().execute('SELECT body FROM entries WHERE asset = ?', (assetId,)).fetchall():
+            cached = json.loads(zlib.decompress(body))
+            for asset in (cached.get('asset') or {}).values():
+                if isinstance(asset, dict):
+                    parents.update(asset[k] for k in ('parentFolderId', 'parentContainerId') if asset.get(k))
+        return parents
+
+    def invalidateAsset(self, assetId):
+        """ Drops every cached read of an asset, whatever type it was read as. """
+        with self._connection() as db:
+            db.execute('DELETE FROM entries WHERE asset = ?', (assetId,))
+
+    def evict(self):
+        """ Drops entries expired for longer than keepStale and, above maxBytes, the least recently used ones. """
+        db = self._connection()
+        with db:
+            expired = db.execute('DELETE FROM entries WHERE expires <= ?', (time.time() - self.keepStale,)).rowcount
+        evicted = expired
+        total = db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if self.maxBytes and total > self.maxBytes:
+            target = total - int(self.maxBytes * 0.9)
+            freed = 0
+            keys = []
+            for key, size in db.execute('SELECT key, size FROM entries ORDER BY accessed'):
+                keys.append((key,))
+                freed += size
+                if freed >= target:
+                    break
+            # one short transaction per batch so other processes are not held up
+            for start in range(0, len(keys), 500):
+                with db:
+                    db.executemany('DELETE FROM entries WHERE key = ?', keys[start:start + 500])
+            evicted += len(keys)
+        with self._lock:
+            self.evictions += evicted
+        return evicted
+
+    def stats(self):
+        db = self._connection()
+        entries, size, rawSize = db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(rawSize), 0) '
+                                            'FROM entries').fetchone()
+        fileBytes = sum(os.path.getsize(self.path + suffix) for suffix in ('', '-wal')
+                        if os.path.exists(self.path + suffix))
+        lookups = self.hits + self.misses
+        return {'entries': entries, 'bytes': size, 'uncompressedBytes': rawSize, 'fileBytes': fileBytes,
+                'maxBytes': self.maxBytes, 'hits': self.hits, 'misses': self.misses,
+                'hitRatio': self.hits / lookups if lookups else 0.0, 'evictions': self.evictions,
+                'revalidated': self.revalidated, 'bytesSaved': self.bytesSaved}
+
+    def clear(self):
+        with self._connection() as db:
+            db.execute('DELETE FROM entries')
+
+
+class AuditRevalidator:
+    """
+    Decides whether an expired read is still current by asking readAudits for
+    anything that happened to the asset since the entry was last verified. An
+    audit list is a few hundred bytes where the asset may be hundreds of KB.
+    Anything other than an empty, successful audit list counts as changed.
+
+    Folders, sites and other containers are never revalidated: adding,
+    moving or deleting a child changes their read (the children list) but
+    is audited on the child, not on the container.
+    """
+    # allowance for clock differences between this machine and the server
+    SKEW = 60
+
+    def __init__(self, driver):
+        self._driver = driver
+        self.checks = 0
+        self.unchangedCount = 0
+
+    def unchanged(self, url, response, verified):
+        match = _ASSET_URL.search(url)
+        if not match or '/api/v1/read/' not in url or not verified:
+            return False
+        assetType = match.group(1)
+        if assetType in ('folder', 'site') or assetType.endswith('Container'):
+            return False
+        since = datetime.fromtimestamp(verified - AuditRevalidator.SKEW, tz=timezone.utc).replace(tzinfo=None)
+        self.checks += 1
+        try:
+            audits = self._driver.readAudits(AuditParameters(CascadeIdentifier(assetType, match.group(2)), startDate=since))
+        except Exception as e:
+            self._driver.debug(f'Revalidation of {url} failed: {e}')
+            return False
+        if audits.get('success') in (False, 'false') or audits.get('audits'):
+            return False
+        self.unchangedCount += 1
+        return True
@@ -0,0 +1,209 @@
+""" Change feed built on readAudits. Polls the audit trail of one or more scopes
+(sites, folders, users) from a cursor saved on disk, drops events it already
+delivered and hands typed ChangeEvents to subscribers, so caches and local
+indexes can follow changes incrementally instead of rescanning. """
+
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from .cmstypes import AuditParameters, CascadeIdentifier
+from .crawler import unwrapAsset
+
+# audit action -> event kind; actions not listed (logins, workflow steps) are ignored
+KINDS = {
+    'edit': 'edit', 'check_in': 'edit', 'activate_version': 'edit',
+    'create': 'create', 'copy': 'create', 'restore': 'create', 'reference': 'create',
+    'move': 'move',
+    'delete': 'delete', 'delete_unpublish': 'delete', 'recycle': 'delete',
+    'publish': 'publish', 'unpublish': 'unpublish',
+}
+
+_DATE_FORMATS = ('%b %d, %Y %I:%M:%S %p', '%b %d, %Y, %I:%M:%S %p', '%Y-%m-%dT%H:%M:%S.%fZ', '%Y-%m-%dT%H:%M:%SZ')
+
+
+def parseAuditDate(value):
+    """ Epoch seconds from an audit date: epoch milliseconds or one of the string forms the API uses. """
+    if isinstance(value, (int, float)):
+        return value / 1000.0
+    # newer JVMs put a narrow no-break space before AM/PM
+    text = str(value).replace('\u202f', ' ').strip()
+    for form in _DATE_FORMATS:
+        try:
+            return datetime.strptime(text, form).replace(tzinfo=timezone.utc).timestamp()
+        except ValueError:
+            continue
+    return datetime.fromisoformat(text).timestamp()
+
+
+class ChangeEvent:
+    """ One audit entry: kind is 'edit', 'create', 'move', 'delete', 'publish' or 'unpublish'. """
+
+    def __init__(self, kind, action, assetType, assetId, path, user, date, raw):
+        self.kind = kind
+        self.action = action
+        self.assetType = assetType
+        self.assetId = assetId
+        self.path = path
+        self.user = user
+        self.date = date
+        self.raw = raw
+
+    @classmethod
+    def fromAudit(cls, audit: dict):
+        kind = KINDS.get(audit.get('action'))
+        identifier = audit.get('identifier') or {}
+        if kind is None or not identifier.get('id'):
+            return None
+        return cls(kind, audit['action'], identifier.get('type'), identifier['id'],
+                   (identifier.get('path') or {}).get('path'), audit.get('user'), parseAuditDate(audit.get('date')), audit)
+
+    @property
+    def key(self):
+        return f'{self.date}|{self.action}|{self.assetType}|{self.assetId}|{self.user}'
+
+    @property
+    def identifier(self):
+        return CascadeIdentifier(type=self.assetType, id=self.assetId)
+
+    def __repr__(self):
+        return f'ChangeEvent({self.kind} {self.assetType} {self.path or self.assetId})'
+
+
+class ChangeFeed:
+    """
+    Usage:
+        feed = ChangeFeed(driver, [CascadeIdentifier('site', siteId)], cursorPath='changes.cursor.json')
+        feed.subscribe(invalidator(driver))
+        feed.subscribe(lambda event: textIndex.remove(event.assetId) if event.kind == 'delete' else None)
+        feed.start(interval=30)   # or: for event in feed.poll(): ...; feed.commit()
+
+    The cursor is the time of the newest delivered event plus the keys of the
+    events at the end of the window; every poll asks for audits from slightly
+    before the cursor (`overlap` seconds) and skips those keys, so late
+    arriving audits are not lost and nothing is delivered twice. The cursor
+    is only saved by commit(), after subscribers have run, so a crash means
+    events are delivered again rather than missed.
+    """
+
+    def __init__(self, driver, scopes, cursorPath=None, overlap=120, since=None):
+        self._driver = driver
+        self.scopes = list(scopes)
+        self.cursorPath = cursorPath
+        self.overlap = overlap
+        self.since = time.time() if since is None else since
+        self.seen = set()
+        self.subscribers = []
+        self._pending = None
+        self._stop = threading.Event()
+        self._thread = None
+        if cursorPath and os.path.exists(cursorPath):
+            with open(cursorPath) as f:
+                cursor = json.load(f)
+            self.since = cursor['since']
+            self.seen = set(cursor.get('seen', []))
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+        return self
+
+    def _audits(self, scope):
+        start = datetime.fromtimestamp(self.since - self.overlap, tz=timezone.utc).replace(tzinfo=None)
+        response = self._driver.readAudits(AuditParameters(scope, startDate=start))
+        if response.get('success') in (False, 'false'):
+            self._driver.error(f"Change feed could not read audits of {scope.type} {scope.id}: {response.get('message')}")
+            return []
+        return response.get('audits') or []
+
+    def poll(self):
+        """ New events across all scopes, oldest first. Call commit() once they are handled. """
+        events = {}
+        for scope in self.scopes:
+            for audit in self._audits(scope):
+                event = ChangeEvent.fromAudit(audit)
+                if event is not None and event.key not in self.seen and event.date >= self.since - self.overlap:
+                    events[event.key] = event
+        ordered = sorted(events.values(), key=lambda e: (e.date, e.key))
+        since = max([self.since] + [e.date for e in ordered])
+        # only keys that can come back inside the next overlap window need remembering
+        seen = {k for k in self.seen | set(events) if float(k.split('|', 1)[0]) >= since - self.overlap}
+        self._pending = (since, seen)
+        return ordered
+
+    def commit(self):
+        if self._pending is None:
+            return
+        self.since, self.seen = self._pending
+        self._pending = None
+        if self.cursorPath:
+            tmp = self.cursorPath + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump({'since': self.since, 'seen': sorted(self.seen)}, f)
+            os.replace(tmp, self.cursorPath)
+
+    def dispatch(self, events):
+        for event in events:
+            for callback in self.subscribers:
+                try:
+                    callback(event)
+                except Exception as e:
+                    self._driver.error(f'Change feed subscriber failed on {event}: {e}')
+
+    def runOnce(self):
+        events = self.poll()
+        self.dispatch(events)
+        self.commit()
+        if events:
+            self._driver.info(f'Change feed delivered {len(events)} events')
+        return events
+
+    def _run(self, interval):
+        while not self._stop.is_set():
+            try:
+                self.runOnce()
+            except Exception as e:
+                self._driver.error(f'Change feed poll failed: {e}')
+            if self._stop.wait(interval):
+                return
+
+    def start(self, interval=30):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, args=(interval,), name='change-feed', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+def invalidator(driver):
+    """ Subscriber that drops cached reads and resolved paths of changed assets. Creates,
+    moves and deletes also drop the folders the asset left and entered, whose cached
+    `children` listings changed without an audit of their own. """
+    def invalidate(event):
+        if event.kind in ('publish', 'unpublish'):
+            return
+        if driver.cache is not None:
+            parents = set()
+            if event.kind in ('create', 'move', 'delete'):
+                # the folder it left, from the cached read that is about to be dropped
+                parents = driver.cache.parentsOf(event.assetId)
+            driver.cache.invalidateAsset(event.assetId)
+            if event.kind in ('create', 'move'):
+                # the folder it is in now
+                asset = unwrapAsset(driver.read(event.identifier))[1] or {}
+                parents.update(asset[k] for k in ('parentFolderId', 'parentContainerId') if asset.get(k))
+            elif event.kind == 'delete' and event.path and '/' in event.path.strip('/'):
+                siteName = ((event.raw.get('identifier') or {}).get('path') or {}).get('siteName')
+                folder = driver.resolver.resolve(siteName, event.path.strip('/').rsplit('/', 1)[0]) if siteName else None
+                if folder is not None:
+                    parents.add(folder.id)
+            for parentId in parents:
+                driver.cache.invalidateAsset(parentId)
+        if event.kind in ('move', 'delete'):
+            driver.resolver.invalidate(event.assetId)
+    return invalidate
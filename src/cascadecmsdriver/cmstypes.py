@@ -1,7 +1,9 @@
-from datetime import datetime, time
+from datetime import datetime, time, timedelta
 from typing import Union
 from enum import Enum
+import fnmatch
 import json
+import re
 
 class CascadeWSDL(dict):
     def __init__(self, wsdlResponse):
@@ -329,16 +331,20 @@ class AuditTypes(Enum):
     move = "move"
 
 
-class AllLevel:
-    pass
+class AllLevel(Enum):
+    none = "none"
+    read = "read"
+    write = "write"
 
 
-class AclEntryType:
-    pass
+class AclEntryType(Enum):
+    user = "user"
+    group = "group"
 
 
-class AclEntryLevel:
-    pass
+class AclEntryLevel(Enum):
+    read = "read"
+    write = "write"
 
 
 class AuthMode:
@@ -483,14 +489,40 @@ class WorkflowConfiguration:
         self.endDate = endDate
 
 
-class AclEntry:
-    def __init__(self, Level: AclEntryLevel, _type: AclEntryType, name: str):
-        pass
+class AclEntry(JSONSerializable):
+    def __init__(self, level: AclEntryLevel, _type: AclEntryType, name: str):
+        self.level = AclEntryLevel(level)
+        self.type = AclEntryType(_type)
+        self.name = name
 
+    @classmethod
+    def fromJson(cls, entry: dict):
+        return cls(entry['level'], entry['type'], entry['name'])
 
-class AccessRightsInformation:
-    def __init__(self, identifier: CascadeIdentifier, aclEntries: list[AclEntry], allLevel: AllLevel):
-        pass
+    def toDict(self):
+        return {'level': self.level.value, 'type': self.type.value, 'name': self.name}
+
+    def toJson(self):
+        return json.dumps(self.toDict())
+
+
+class AccessRightsInformation(JSONSerializable):
+    def __init__(self, identifier: CascadeIdentifier, aclEntries: list[AclEntry], allLevel: AllLevel = AllLevel.none):
+        self.identifier = identifier
+        self.aclEntries = list(aclEntries)
+        self.allLevel = AllLevel(allLevel)
+
+    @classmethod
+    def fromJson(cls, info: dict):
+        """ Builds the object from the accessRightsInformation of a readAccessRights response. """
+        identifier = info.get('identifier') or {}
+        return cls(CascadeIdentifier(identifier.get('type'), identifier.get('id')),
+                   [AclEntry.fromJson(e) for e in info.get('aclEntries') or []], info.get('allLevel') or 'none')
+
+    def toJson(self):
+        return json.dumps({'identifier': {'type': self.identifier.type, 'id': self.identifier.id},
+                           'aclEntries': [e.toDict() for e in self.aclEntries],
+                           'allLevel': self.allLevel.value})
 
 
 class Asset:
@@ -642,14 +674,158 @@ class PublishableAsset:
         pass
 
 
-class StructuredDataNode:
-    def __init__(self, _type: StructuredDataType, identifier: str, structuredDataNodes: list, text: str, assetType: StructuredDataAssetType, blockId: str, blockPath: str, fileId: str, filePath: str, pageId: str, pagePath: str, symLinkId: str, symLinkPath: str, recycled: bool):
-        pass
+class StructuredDataNode(JSONSerializable):
+    """ View over one raw structuredDataNodes entry. Reads and writes go straight
+    to the underlying dict, so the owning StructuredData serializes with no
+    extra work. `path` is the identifier path ('group/sub/field'); `indexedPath`
+    adds each segment's position among same-named siblings ('group[0]/sub[1]/field[0]'). """
 
+    def __init__(self, raw: dict, parent=None, path: str = '', indexedPath: str = ''):
+        self.raw = raw
+        self.parent = parent
+        self.path = path
+        self.indexedPath = indexedPath
+        self.children = []
 
-class StructuredData:
-    def __init__(self, definitionId: str, definitionPath: str, structuredDataNodes: list[StructuredDataNode]):
-        pass
+    @property
+    def type(self):
+        return self.raw.get('type')
+
+    @property
+    def identifier(self):
+        return self.raw.get('identifier')
+
+    @property
+    def text(self):
+        return self.raw.get('text')
+
+    @text.setter
+    def text(self, value):
+        self.raw['text'] = value
+
+    def toJson(self):
+        return json.dumps(self.raw)
+
+
+class StructuredData(JSONSerializable):
+    """
+    Indexed tree over a page or block's structuredData, built once. Lookups by
+    identifier path are dict lookups:
+
+        sd = StructuredData.fromAsset(response['asset']['page'])
+        sd.text('hero/heading')                # first match
+        sd.getAll('links/link/url')            # every repeat
+        sd.set('hero/heading', 'New title')    # written into the asset in place
+        sd.query('sections[*]/**/image')       # pattern query
+
+    Query segments are identifiers or fnmatch patterns, optionally followed by
+    [n] (nth repeat) or [*]; '**' matches any number of levels.
+    """
+    _SEGMENT = re.compile(r'^(?P<name>[^\[\]]+)(\[(?P<index>\d+|\*)\])?$')
+
+    def __init__(self, definitionId: str = None, definitionPath: str = None, structuredDataNodes: list = None, raw: dict = None):
+        if raw is None:
+            raw = {'definitionId': definitionId, 'definitionPath': definitionPath,
+                   'structuredDataNodes': [n.raw if isinstance(n, StructuredDataNode) else n for n in structuredDataNodes or []]}
+        self.raw = raw
+        self.reindex()
+
+    @classmethod
+    def fromAsset(cls, asset: dict):
+        """ Wraps asset['structuredData'] in place; edits show up in the asset dict. """
+        return cls(raw=asset.setdefault('structuredData', {'structuredDataNodes': []}))
+
+    def reindex(self):
+        self.roots = []
+        self._byPath = {}
+        self._byIndexedPath = {}
+        self._build(self.raw.get('structuredDataNodes') or [], None, self.roots)
+
+    def _build(self, rawNodes, parent, siblings):
+        seen = {}
+        for raw in rawNodes:
+            identifier = raw.get('identifier', '')
+            position = seen.get(identifier, 0)
+            seen[identifier] = position + 1
+            path = f'{parent.path}/{identifier}' if parent else identifier
+            indexedPath = f'{parent.indexedPath}/{identifier}[{position}]' if parent else f'{identifier}[{position}]'
+            node = StructuredDataNode(raw, parent, path, indexedPath)
+            siblings.append(node)
+            self._byPath.setdefault(path, []).append(node)
+            self._byIndexedPath[indexedPath] = node
+            self._build(raw.get('structuredDataNodes') or [], node, node.children)
+
+    def _parse(self, path):
+        segments = []
+        for segment in path.strip('/').split('/'):
+            match = StructuredData._SEGMENT.match(segment)
+            if match is None:
+                raise ValueError(f'Invalid structured data path segment {segment!r} in {path!r}')
+            segments.append((match.group('name'), match.group('index')))
+        return segments
+
+    def get(self, path: str):
+        """ Node at `path` or None. Segments without [n] mean the first repeat. """
+        if '[' not in path:
+            nodes = self._byPath.get(path.strip('/'))
+            return nodes[0] if nodes else None
+        indexed = '/'.join(f'{name}[{index or 0}]' for name, index in self._parse(path))
+        return self._byIndexedPath.get(indexed)
+
+    def nodes(self):
+        """ Every node, depth first. """
+        return list(self._byIndexedPath.values())
+
+    def getAll(self, path: str):
+        """ Every node whose identifier path is `path`, across all repeats. """
+        return list(self._byPath.get(path.strip('/'), []))
+
+    def text(self, path: str, default=None):
+        node = self.get(path)
+        return node.text if node is not None else default
+
+    def set(self, path: str, value: str):
+        node = self.get(path)
+        if node is None:
+            raise KeyError(path)
+        node.text = value
+        return node
+
+    def query(self, expression: str):
+        results = []
+        self._match(self.roots, self._parse(expression), results, set())
+        return results
+
+    def _match(self, nodes, segments, results, seen):
+        if not segments:
+            return
+        (name, index), rest = segments[0], segments[1:]
+        if name == '**':
+            # zero levels: match the rest here; one or more levels: descend and keep '**'
+            self._match(nodes, rest, results, seen)
+            for node in nodes:
+                self._match(node.children, segments, results, seen)
+            return
+        positions = {}
+        for node in nodes:
+            identifier = node.identifier or ''
+            position = positions.get(identifier, 0)
+            positions[identifier] = position + 1
+            if not fnmatch.fnmatchcase(identifier, name):
+                continue
+            if index not in (None, '*') and int(index) != position:
+                continue
+            if rest:
+                self._match(node.children, rest, results, seen)
+            elif id(node) not in seen:
+                seen.add(id(node))
+                results.append(node)
+
+    def toDict(self):
+        return self.raw
+
+    def toJson(self):
+        return json.dumps(self.raw)
 
 
 class MetadataSet:
@@ -687,9 +863,34 @@ class Symlink:
         pass
 
 
-class AuditParameters:
-    def __init__(self, identifier: CascadeIdentifier, username: str, groupname: str, roleName: str, startDate: datetime, endDate: datetime, auditType: AuditTypes):
-        pass
+class AuditParameters(JSONSerializable):
+    def __init__(self, identifier: CascadeIdentifier, username: str = None, groupname: str = None, roleName: str = None, startDate: datetime = None, endDate: datetime = None, auditType: AuditTypes = None):
+        self.identifier = identifier
+        self.username = username
+        self.groupname = groupname
+        self.roleName = roleName
+        self.startDate = startDate
+        self.endDate = endDate
+        self.auditType = auditType
+
+    @staticmethod
+    def _date(value):
+        if isinstance(value, datetime):
+            return value.strftime('%Y-%m-%dT%H:%M:%S.000Z') if value.utcoffset() in (None, timedelta(0)) else value.isoformat()
+        return value
+
+    def toJson(self):
+        params = {'identifier': {'type': self.identifier.type, 'id': self.identifier.id}}
+        for name in ('username', 'groupname', 'roleName'):
+            if getattr(self, name):
+                params[name] = getattr(self, name)
+        if self.startDate:
+            params['startDate'] = AuditParameters._date(self.startDate)
+        if self.endDate:
+            params['endDate'] = AuditParameters._date(self.endDate)
+        if self.auditType:
+            params['auditType'] = self.auditType.value if isinstance(self.auditType, AuditTypes) else self.auditType
+        return json.dumps(params)
 
 
 class Authentication:
@@ -1090,7 +1291,7 @@ class Scriptformat:
 
 
 class SearchInformation:
-    def __init__(self, Searchterms: str, searchFields: list[str], Searchtypes: list[str]):
+    def __init__(self, Searchterms: str, searchFields: list[str], Searchtypes: list[str], siteId: str = None, siteName: str = None):
         self.payload = {
             "searchInformation": {
                 "searchTerms": Searchterms,
@@ -1098,6 +1299,18 @@ class SearchInformation:
                 "searchTypes": Searchtypes
             }
         }
+        if siteId:
+            self.payload["searchInformation"]["siteId"] = siteId
+        elif siteName:
+            self.payload["searchInformation"]["siteName"] = siteName
+
+    def normalizedKey(self):
+        """ Stable key for the payload: list order and surrounding whitespace do not matter. """
+        info = dict(self.payload["searchInformation"])
+        info["searchTerms"] = (info.get("searchTerms") or "").strip()
+        info["searchFields"] = sorted(info.get("searchFields") or [])
+        info["searchTypes"] = sorted(info.get("searchTypes") or [])
+        return json.dumps(info, sort_keys=True)
 
 
 class SharedField:
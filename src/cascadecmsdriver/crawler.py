@@ -0,0 +1,74 @@
+""" Folder tree crawler for the Cascade CMS 8 REST API. Walks a folder (or a
+site's root folder) breadth-first and yields the identifier record of every
+descendant asset, reading each level of folders concurrently. """
+
+from concurrent.futures import ThreadPoolExecutor
+from .cmstypes import CascadeIdentifier
+from .lanes import carryLane
+
+
+def unwrapAsset(response):
+    """ Returns (key, asset) from a read response. The key is the asset's property
+    name, e.g. 'page' or 'xhtmlDataDefinitionBlock', which is not always the
+    identifier type used to read it. (None, None) when the read failed. """
+    asset = (response or {}).get('asset') or {}
+    for key, value in asset.items():
+        if isinstance(value, dict):
+            return key, value
+    return None, None
+
+
+def matchesType(assetType, types):
+    """ True when `assetType` is in `types` or its base type is ('block_TEXT' matches 'block'). """
+    return len(types) == 0 or assetType in types or assetType.split('_', 1)[0] in types
+
+
+class FolderCrawler:
+    """
+    Breadth-first walk over a folder tree using a CascadeCMSRestDriver.
+    Yields raw identifier records ({'id', 'type', 'path', 'recycled'}) as
+    returned in folder `children` listings. Folders that could not be read
+    are skipped along with everything below them and counted in
+    `failedFolders`, so callers can tell a partial crawl from a complete one.
+    """
+
+    def __init__(self, driver, types=(), includeRecycled=False, maxWorkers=4):
+        self._driver = driver
+        self.types = tuple(types)
+        self.includeRecycled = includeRecycled
+        self.maxWorkers = maxWorkers
+        self.failedFolders = 0
+
+    def _readFolder(self, identifier):
+        return unwrapAsset(self._driver.read(identifier))[1]
+
+    def _resolveRoot(self, root):
+        if isinstance(root, dict):
+            root = CascadeIdentifier(type=root['type'], id=root['id'])
+        if root.type == 'site':
+            site = unwrapAsset(self._driver.read(root))[1] or {}
+            root = CascadeIdentifier(type='folder', id=site.get('rootFolderId'))
+        return root
+
+    def crawl(self, root):
+        """ Yields every descendant of `root` (a folder or site identifier),
+        one folder level at a time. Folders are always descended into, even when
+        `types` excludes them from the output. """
+        level = [self._resolveRoot(root)]
+        # pool threads read in the lane of the thread running the crawl
+        readFolder = carryLane(self._driver, self._readFolder)
+        with ThreadPoolExecutor(max_workers=self.maxWorkers) as pool:
+            while level:
+                nextLevel = []
+                for folder in pool.map(readFolder, level):
+                    if folder is None:
+                        self.failedFolders += 1
+                        continue
+                    for child in folder.get('children', []):
+                        if child.get('recycled') and not self.includeRecycled:
+                            continue
+                        if child['type'] == 'folder':
+                            nextLevel.append(CascadeIdentifier(type='folder', id=child['id']))
+                        if matchesType(child['type'], self.types):
+                            yield child
+                level = nextLevel
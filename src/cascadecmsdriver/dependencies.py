@@ -0,0 +1,151 @@
+""" Reverse reference index over crawled assets. Answers "which assets use X"
+from memory and computes the pages to republish after a shared asset changes. """
+
+import json
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from .cmstypes import CascadeIdentifier, StructuredData
+from .crawler import FolderCrawler, unwrapAsset
+from .lanes import carryLane
+
+# asset types whose content can point at other assets; files and symlinks are only ever
+# referenced, so they show up as targets of these without being read
+INDEXED_TYPES = ('page', 'block', 'template', 'format')
+
+
+class DependencyIndex:
+    """
+    Forward (asset -> referenced ids) and reverse (id -> referencing assets)
+    maps. update() replaces one asset's outgoing edges, so re-crawled assets can
+    be fed in one at a time to keep the index current.
+    """
+    REFERENCE_KEYS = ('blockId', 'fileId', 'pageId', 'symLinkId', 'formatId')
+
+    def __init__(self):
+        self._forward = {}
+        self._reverse = {}
+        self._types = {}
+
+    @staticmethod
+    def extractReferences(asset: dict):
+        refs = set()
+        if asset.get('structuredData'):
+            for node in StructuredData(raw=asset['structuredData']).nodes():
+                for key in DependencyIndex.REFERENCE_KEYS:
+                    if node.raw.get(key):
+                        refs.add(node.raw[key])
+        regions = list(asset.get('pageRegions') or [])
+        for configuration in asset.get('pageConfigurations') or []:
+            if configuration.get('formatId'):
+                refs.add(configuration['formatId'])
+            regions.extend(configuration.get('pageRegions') or [])
+        for region in regions:
+            for key in ('blockId', 'formatId'):
+                if region.get(key):
+                    refs.add(region[key])
+        refs.discard(asset.get('id'))
+        return refs
+
+    def update(self, asset: dict, assetType: str):
+        assetId = asset['id']
+        new = DependencyIndex.extractReferences(asset)
+        old = self._forward.get(assetId, set())
+        for ref in old - new:
+            users = self._reverse.get(ref)
+            if users is not None:
+                users.discard(assetId)
+                if not users:
+                    del self._reverse[ref]
+        for ref in new - old:
+            self._reverse.setdefault(ref, set()).add(assetId)
+        self._forward[assetId] = new
+        self._types[assetId] = assetType
+
+    def remove(self, assetId: str):
+        for ref in self._forward.pop(assetId, set()):
+            users = self._reverse.get(ref)
+            if users is not None:
+                users.discard(assetId)
+                if not users:
+                    del self._reverse[ref]
+        self._types.pop(assetId, None)
+
+    def referencedBy(self, assetId: str):
+        """ Ids of assets that reference `assetId` directly. """
+        return set(self._reverse.get(assetId, ()))
+
+    def referencesOf(self, assetId: str):
+        return set(self._forward.get(assetId, ()))
+
+    def pagesToPublish(self, changedIds, followPages=False):
+        """
+        Pages whose output depends on any of `changedIds`, following chains of
+        blocks, formats and files. Referencing pages are collected but not
+        followed further unless followPages is True (a page linking to a
+        changed page only needs republishing when link targets matter).
+        """
+        if isinstance(changedIds, str):
+            changedIds = [changedIds]
+        pages = set()
+        seen = set(changedIds)
+        frontier = list(changedIds)
+        for assetId in changedIds:
+            if self._types.get(assetId) == 'page':
+                pages.add(assetId)
+        while frontier:
+            nextFrontier = []
+            for assetId in frontier:
+                for user in self._reverse.get(assetId, ()):
+                    if user in seen:
+                        continue
+                    seen.add(user)
+                    if self._types.get(user) == 'page':
+                        pages.add(user)
+                        if not followPages:
+                            continue
+                    nextFrontier.append(user)
+            frontier = nextFrontier
+        return pages
+
+    def build(self, driver, root, maxWorkers=4):
+        """ Crawls `root` (folder or site) and indexes every referencing asset type. """
+        crawler = FolderCrawler(driver, types=INDEXED_TYPES, maxWorkers=maxWorkers)
+
+        def read(child):
+            response = driver.read(CascadeIdentifier(type=child['type'], id=child['id']))
+            return child['type'], unwrapAsset(response)[1]
+
+        pending = set()
+
+        def collect(futures):
+            for future in futures:
+                assetType, asset = future.result()
+                if asset:
+                    self.update(asset, assetType)
+
+        read = carryLane(driver, read)
+        with ThreadPoolExecutor(max_workers=maxWorkers) as pool:
+            for child in crawler.crawl(root):
+                # keep only a few asset bodies in memory; map() would queue the whole crawl
+                if len(pending) >= maxWorkers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                pending.add(pool.submit(read, child))
+            collect(wait(pending).done)
+        driver.info(f'Dependency index holds {len(self._forward)} assets and {len(self._reverse)} referenced ids')
+        return self
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({'types': self._types, 'forward': {k: sorted(v) for k, v in self._forward.items()}}, f)
+
+    @classmethod
+    def load(cls, path):
+        index = cls()
+        with open(path) as f:
+            data = json.load(f)
+        for assetId, refs in data['forward'].items():
+            index._forward[assetId] = set(refs)
+            for ref in refs:
+                index._reverse.setdefault(ref, set()).add(assetId)
+        index._types = data['types']
+        return index
@@ -0,0 +1,151 @@
+""" Diff between two export snapshots, e.g. before and after a migration. The
+Merkle index narrows the comparison to changed subtrees first, so only the
+records that actually differ are loaded and compared field by field. Can be run
+as `python -m cascadecmsdriver.diff`. """
+
+import argparse
+import json
+import os
+from .cmstypes import StructuredData
+from .snapshot import FORMAT, SnapshotIndex, LOCATION, VOLATILE, iterSnapshot, snapshotFormat
+
+
+def loadIndex(snapshotPath):
+    """ The index.json written by the export, or one built from the records for snapshots
+    without one or written in an older FORMAT, whose hashes are computed again. """
+    path = os.path.join(snapshotPath, 'index.json') if os.path.isdir(snapshotPath) else f'{snapshotPath}.index.json'
+    if os.path.exists(path) and snapshotFormat(snapshotPath) == FORMAT:
+        return SnapshotIndex.load(path)
+    return SnapshotIndex.fromSnapshot(snapshotPath)
+
+
+def _structuredDataFields(before, after):
+    old = {n.indexedPath: n.text for n in StructuredData(raw=before).nodes() if n.text is not None}
+    new = {n.indexedPath: n.text for n in StructuredData(raw=after).nodes() if n.text is not None}
+    return [f'structuredData.{p}' for p in sorted(set(old) | set(new)) if old.get(p) != new.get(p)]
+
+
+def changedFields(before: dict, after: dict):
+    """ Dotted names of the properties that differ between two versions of an asset. """
+    fields = []
+    for key in sorted(set(before) | set(after)):
+        if key in VOLATILE or key in LOCATION or before.get(key) == after.get(key):
+            continue
+        old, new = before.get(key), after.get(key)
+        if key == 'metadata' and isinstance(old, dict) and isinstance(new, dict):
+            for name in sorted(set(old) | set(new)):
+                if name == 'dynamicFields' or old.get(name) == new.get(name):
+                    continue
+                fields.append(f'metadata.{name}')
+            oldDynamic = {f.get('name'): f.get('fieldValues') for f in old.get('dynamicFields') or []}
+            newDynamic = {f.get('name'): f.get('fieldValues') for f in new.get('dynamicFields') or []}
+            fields.extend(f'metadata.dynamicFields.{name}' for name in sorted(set(oldDynamic) | set(newDynamic), key=str)
+                          if oldDynamic.get(name) != newDynamic.get(name))
+        elif key == 'structuredData' and isinstance(old, dict) and isinstance(new, dict):
+            fields.extend(_structuredDataFields(old, new) or ['structuredData'])
+        else:
+            fields.append(key)
+    return fields
+
+
+class SnapshotDiff:
+    """
+    Usage:
+        diff = SnapshotDiff('before.ndjson.gz', 'after.ndjson.gz')
+        for change in diff.changes():
+            ...
+        diff.write('report.ndjson')
+
+    Every change is a dict {'change', 'id', 'type', 'path'} where change is one
+    of 'added', 'removed', 'moved', 'modified' or 'recreated'. Moved assets carry
+    'from' (old path), modified ones 'fields' (see changedFields), and recreated
+    ones, deleted and created again under a new id with identical content,
+    carry 'previousId'. An asset that was both moved and edited is reported
+    once as 'moved' with its 'fields'.
+    """
+
+    def __init__(self, beforePath, afterPath):
+        self.beforePath = beforePath
+        self.afterPath = afterPath
+        self.before = loadIndex(beforePath)
+        self.after = loadIndex(afterPath)
+        self.stats = {}
+
+    def _records(self, path, ids):
+        return {r['id']: r['asset'] for r in iterSnapshot(path) if r['id'] in ids} if ids else {}
+
+    def changes(self):
+        """ Yields the changes one at a time, in path order within each kind. """
+        changedIds, skipped = self.before.changedIds(self.after)
+        old, new = self.before.entries, self.after.entries
+        added = [i for i in changedIds if i in new and i not in old]
+        removed = [i for i in changedIds if i in old and i not in new]
+        # folders show up in changedIds whenever something below them changed
+        common = [i for i in changedIds if i in old and i in new and
+                  (old[i]['hash'] != new[i]['hash'] or old[i]['parent'] != new[i]['parent'] or old[i]['path'] != new[i]['path'])]
+        self.stats = {'compared': len(changedIds), 'skipped': skipped}
+
+        removedByHash = {}
+        for assetId in removed:
+            removedByHash.setdefault(old[assetId]['hash'], []).append(assetId)
+        recreated = {}
+        for assetId in added:
+            candidates = removedByHash.get(new[assetId]['hash'])
+            if candidates:
+                recreated[assetId] = candidates.pop()
+
+        def byPath(ids, entries):
+            return sorted(ids, key=lambda i: (entries[i]['path'] or '', i))
+
+        edited = [i for i in common if old[i]['hash'] != new[i]['hash']]
+        beforeAssets = self._records(self.beforePath, set(edited))
+        afterAssets = self._records(self.afterPath, set(edited))
+        for assetId in byPath(common, new):
+            entry = new[assetId]
+            change = {'change': 'modified', 'id': assetId, 'type': entry['type'], 'path': entry['path']}
+            if old[assetId]['parent'] != entry['parent'] or old[assetId]['path'] != entry['path']:
+                change['change'] = 'moved'
+                change['from'] = old[assetId]['path']
+            if assetId in beforeAssets and assetId in afterAssets:
+                change['fields'] = changedFields(beforeAssets[assetId], afterAssets[assetId])
+            yield change
+        for assetId in byPath(added, new):
+            entry = new[assetId]
+            change = {'change': 'added', 'id': assetId, 'type': entry['type'], 'path': entry['path']}
+            if assetId in recreated:
+                change['change'] = 'recreated'
+                change['previousId'] = recreated[assetId]
+            yield change
+        matched = set(recreated.values())
+        for assetId in byPath(removed, old):
+            if assetId not in matched:
+                entry = old[assetId]
+                yield {'change': 'removed', 'id': assetId, 'type': entry['type'], 'path': entry['path']}
+
+    def write(self, path):
+        """ Streams the report as NDJSON and returns the number of changes per kind. """
+        counts = {}
+        with open(path, 'w') as f:
+            for change in self.changes():
+                counts[change['change']] = counts.get(change['change'], 0) + 1
+                f.write(json.dumps(change) + '\n')
+        return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare two Cascade CMS export snapshots.')
+    parser.add_argument('before', help='earlier snapshot (.ndjson.gz file or shard directory)')
+    parser.add_argument('after', help='later snapshot')
+    parser.add_argument('--out', default=None, help='write the report as NDJSON instead of to stdout')
+    args = parser.parse_args()
+    diff = SnapshotDiff(args.before, args.after)
+    if args.out:
+        counts = diff.write(args.out)
+        print(json.dumps({'counts': counts, **diff.stats}))
+        return
+    for change in diff.changes():
+        print(json.dumps(change))
+
+
+if __name__ == '__main__':
+    main()
@@ -4,20 +4,47 @@ for enterprise-scale content management. """
 import requests
 import logging
 import json
+import os
+import threading
+from contextlib import contextmanager, nullcontext
 from .cmstypes import *
-import requests_cache
+from .resolver import PathResolver
+from .filestream import CHUNK_SIZE, fileBody, readFileResponse
+from .cache import AuditRevalidator, ResponseCache, cacheKey
+from .lanes import LANE_INTERACTIVE, PriorityLanes
 
 
 #TODO: update all Identifier types to use CascadeIdentifier class instead.
 
 class CascadeCMSRestDriver:
-    CACHE_LOCATION="./app/cache" #with .sqlite at the end
-    def __init__(self, organization_name="", username="", password="", api_key="", verbose=False):
+    CACHE_LOCATION="./app/responses" #with .sqlite at the end
+    def __init__(self, organization_name="", username="", password="", api_key="", verbose=False, cache=True, revalidate=False,
+                 lanes=True, prefetch=False):
         self.setup_logging(verbose=verbose)
         self.info('Setting up new driver')
         self.organization_name = organization_name
         self.base_url = f'https://{self.organization_name}.cascadecms.com'
-        self.session = requests_cache.CachedSession(cache_name=CascadeCMSRestDriver.CACHE_LOCATION,expire_after=259200)
+        self.session = requests.Session()
+        # uncached session for streamed file transfers, created on first use
+        self._transfers = None
+        # callables notified with the url and body of every write request (cache invalidation etc.)
+        self.writeListeners = []
+        # JSON response cache shared with CascadeCMSRestDriverAsync; cache may also be a ResponseCache
+        if cache is True:
+            cache = ResponseCache(f'{CascadeCMSRestDriver.CACHE_LOCATION}.sqlite')
+        self.cache = cache.attach(self) if cache else None
+        # with revalidate=True expired reads are confirmed with a small audit query before being fetched again
+        self.revalidator = AuditRevalidator(self) if revalidate and self.cache is not None else None
+        # per-thread flags, e.g. refreshing the cache instead of reading from it, and the request lane
+        self._local = threading.local()
+        # priority lanes every HTTP call is scheduled through; lanes may also be a PriorityLanes or a capacity
+        if lanes is True:
+            lanes = PriorityLanes()
+        elif isinstance(lanes, int) and lanes is not False:
+            lanes = PriorityLanes(capacity=lanes)
+        self.lanes = lanes or None
+        # (site, path) -> id cache used to send path-addressed reads by id; prefetch=True reads child folders ahead
+        self.resolver = PathResolver(prefetch=prefetch).attach(self)
         if username == "" and password == "":
             assert api_key != ""
             self.debug(f"Using API Key: {api_key}")
@@ -52,22 +79,104 @@ class CascadeCMSRestDriver:
     def error(self, msg):
         self.logger.error(msg, extra=self.prefix)
 
+    # POST endpoints that do not change content and so do not notify write listeners
+    READ_ONLY_POSTS = ('search', 'readAudits')
+
+    def _transferSession(self):
+        if self._transfers is None:
+            self._transfers = requests.Session()
+            self._transfers.headers.update(self.session.headers)
+            self._transfers.auth = self.session.auth
+        return self._transfers
+
+    @contextmanager
+    def refreshingCache(self):
+        """ Reads on this thread inside the block skip cached entries and store fresh
+        ones, renewing their expiry (used by CacheWarmer). """
+        self._local.refresh = True
+        try:
+            yield
+        finally:
+            self._local.refresh = False
+
+    @contextmanager
+    def lane(self, name):
+        """ Requests made on this thread inside the block are queued in lane `name`
+        (see lanes.LANES); the default lane is interactive. """
+        previous = getattr(self._local, 'lane', None)
+        self._local.lane = name
+        try:
+            yield
+        finally:
+            self._local.lane = previous
+
+    def currentLane(self):
+        return getattr(self._local, 'lane', None) or (self.lanes.lanes[0] if self.lanes is not None else LANE_INTERACTIVE)
+
+    def _slot(self):
+        return self.lanes.slot(self.currentLane()) if self.lanes is not None else nullcontext()
+
+    def laneStats(self):
+        """ Requests and queue wait times per lane. """
+        return self.lanes.stats() if self.lanes is not None else {}
+
+    def _get(self, url):
+        key = cacheKey('GET', url)
+        if self.cache is not None and not getattr(self._local, 'refresh', False):
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+            if self.revalidator is not None:
+                stale = self.cache.getStale(key)
+                if stale is not None and self.revalidator.unchanged(url, *stale):
+                    self.cache.renew(key)
+                    return stale[0]
+        with self._slot():
+            response = self.session.get(url).json()
+        # failures come back as 200s too and must not be cached
+        if self.cache is not None and response.get('success') not in (False, 'false'):
+            self.cache.put(key, url, response)
+        return response
+
+    def _post(self, url, data=None, stream=False, notify=None):
+        """ `notify` is the body write listeners see instead of `data`, for streamed bodies they cannot read. """
+        session = self._transferSession() if stream else self.session
+        with self._slot():
+            response = session.post(url, data=data).json()
+        endpoint = url.split('/api/v1/', 1)[-1].split('/', 1)[0]
+        if endpoint not in CascadeCMSRestDriver.READ_ONLY_POSTS:
+            for listener in self.writeListeners:
+                listener(url, data if notify is None else notify)
+        return response
+
+    def _readResolved(self, assetType, assetIdentifier):
+        """ Reads an asset, sending a path as its cached id when one is known. If that id
+        is gone or now lives at another path, the mapping is dropped and the path read. """
+        assetId = self.resolver.rewrite(assetType, assetIdentifier)
+        url = f'{self.base_url}/api/v1/read/{assetType}/{assetId}'
+        self.debug(f'Reading {assetType} {assetId} at {url}')
+        response = self._get(url)
+        if assetId != assetIdentifier and not self.resolver.confirms(assetIdentifier, response):
+            self.debug(f'Cached id {assetId} no longer resolves {assetIdentifier}, reading by path')
+            self.resolver.invalidate(assetId)
+            response = self._get(f'{self.base_url}/api/v1/read/{assetType}/{assetIdentifier}')
+        self.resolver.learn(assetType, response)
+        return response
+
     def read_asset(self, asset_type='page', asset_identifier=None):
-        url = f'{self.base_url}/api/v1/read/{asset_type}/{asset_identifier}'
-        self.debug(f'Reading {asset_type} {asset_identifier} at {url}')
-        return self.session.get(url).json()
+        return self._readResolved(asset_type, asset_identifier)
 
     def read_asset_workflow_settings(self, asset_type='page', asset_identifier=None):
         url = f'{self.base_url}/api/v1/readWorkflowSettings/{asset_type}/{asset_identifier}'
         self.debug(f'Reading workflow settings for {asset_type} {asset_identifier} at {url}')
-        return self.session.get(url).json()
+        return self._get(url)
 
     def edit_asset_workflow_settings(self, asset_type='page', asset_identifier=None, payload=None):
         if payload and isinstance(payload, dict) and 'workflowSettings' in payload:
             url = f'{self.base_url}/api/v1/editWorkflowSettings/{asset_type}/{asset_identifier}'
             self.debug(f'Editing workflow settings for {asset_type} {asset_identifier} at {url}')
             body = json.dumps(payload)
-            return self.session.post(url, data=body).json()
+            return self._post(url, data=body)
         else:
             self.error('Payload must include workflowSettings dict')
             return None
@@ -87,7 +196,7 @@ class CascadeCMSRestDriver:
         url = f'{self.base_url}/api/v1/publish/{asset_type}/{asset_identifier}'
         self.debug(f'Publishing {asset_type} {asset_identifier} at {url}')
         body = json.dumps(publish_information) if publish_information else None
-        return self.session.post(url, data=body).json()
+        return self._post(url, data=body)
 
     def unpublish_asset(self, asset_type='page', asset_identifier=''):
         self.debug(f'Unpublishing {asset_type} {asset_identifier}')
@@ -106,39 +215,39 @@ class CascadeCMSRestDriver:
             }
         }
         self.debug(f'Copying asset payload: {payload} to {url}')
-        return self.session.post(url, data=json.dumps(payload)).json()
+        return self._post(url, data=json.dumps(payload))
 
     def batch(self, operations: [Operation]):
         url = f'{self.base_url}/api/v1/batch'
         ops_list = [json.loads(op.toJson()) for op in operations]
         payload = {'operations': ops_list}
         self.debug(f'Batch payload: {payload}')
-        return self.session.post(url, data=json.dumps(payload)).json()
+        return self._post(url, data=json.dumps(payload))
 
     def checkIn(self, identifier: CascadeIdentifier, comments: str):
         url = f'{self.base_url}/api/v1/checkIn/{identifier.type}/{identifier.id}'
         payload = CheckIn(identifier=identifier, comments=comments).toJson()
         self.debug(f'CheckIn payload: {payload} to {url}')
-        return self.session.post(url, data=payload).json()
+        return self._post(url, data=payload)
 
     def checkOut(self, identifier: CascadeIdentifier):
         url = f'{self.base_url}/api/v1/checkOut/{identifier.type}/{identifier.id}'
         payload = CheckOut(identifier=identifier).toJson()
         self.debug(f'CheckOut payload: {payload} to {url}')
-        return self.session.post(url, data=payload).json()
+        return self._post(url, data=payload)
 
     def copy(self, identifier: CascadeIdentifier, copyParameters: CopyParameters, workflowConfiguration: WorkflowConfiguration):
         url = f'{self.base_url}/api/v1/copy/{identifier.type}/{identifier.id}'
         payload = Copy(identifier=identifier, copyParameters=copyParameters, workflowConfiguration=workflowConfiguration).toJson()
         self.debug(f'Copy payload: {payload} to {url}')
-        return self.session.post(url, data=payload).json()
+        return self._post(url, data=payload)
 
     def create(self, asset: Asset):
         url = f'{self.base_url}/api/v1/create'
-        body = json.loads(asset.toJson())
+        body = asset if isinstance(asset, dict) else json.loads(asset.toJson())
         payload = {'asset': body.get('asset', body)}
         self.debug(f'Create payload: {payload}')
-        return self.session.post(url, data=json.dumps(payload)).json()
+        return self._post(url, data=json.dumps(payload))
 
     def delete(self, identifier: CascadeIdentifier, deleteParameters: DeleteParameters, workflowConfiguration: WorkflowConfiguration=None):
         url = f'{self.base_url}/api/v1/delete/{identifier.type}/{identifier.id}'
@@ -146,30 +255,30 @@ class CascadeCMSRestDriver:
         if workflowConfiguration:
             payload['workflowConfiguration'] = json.loads(workflowConfiguration.toJson())
         self.debug(f'Delete payload: {payload}')
-        return self.session.post(url, data=json.dumps(payload)).json()
+        return self._post(url, data=json.dumps(payload))
 
     def deleteMessage(self, identifier: CascadeIdentifier):
         url = f'{self.base_url}/api/v1/deleteMessage/{identifier.type}/{identifier.id}'
         self.debug(f'DeleteMessage at {url}')
-        return self.session.post(url).json()
+        return self._post(url)
 
     def edit(self, asset: CascadeWSDL):
         url = f'{self.base_url}/api/v1/edit'
         payload = asset
         self.debug(f'Edit payload: {payload}')
-        return self.session.post(url, data=json.dumps(payload)).json()
+        return self._post(url, data=json.dumps(payload))
 
     def editAccessRights(self, accessRightsInformation: AccessRightsInformation, applyToChildren: bool=False):
         url = f'{self.base_url}/api/v1/editAccessRights/{accessRightsInformation.identifier.type}/{accessRightsInformation.identifier.id}'
         payload = {'accessRightsInformation': json.loads(accessRightsInformation.toJson()), 'applyToChildren': applyToChildren}
         self.debug(f'EditAccessRights payload: {payload}')
-        return self.session.post(url, data=json.dumps(payload)).json()
+        return self._post(url, data=json.dumps(payload))
 
     def editPreference(self, preference: Preference):
         url = f'{self.base_url}/api/v1/editPreference'
         payload = {'preference': json.loads(preference.toJson())}
         self.debug(f'EditPreference payload: {payload}')
-        return self.session.post(url, data=json.dumps(payload)).json()
+        return self._post(url, data=json.dumps(payload))
 
     def editWorkflowSettings(self, workflowSettings: WorkflowSettings, applyInheritWorkflowsToChildren: bool=False, applyRequireWorkflowToChildren: bool=False):
         ident = workflowSettings.identifier
@@ -178,33 +287,33 @@ class CascadeCMSRestDriver:
                    'applyInheritWorkflowsToChildren': applyInheritWorkflowsToChildren,
                    'applyRequireWorkflowToChildren': applyRequireWorkflowToChildren}
         self.debug(f'EditWorkflowSettings payload: {payload}')
-        return self.session.post(url, data=json.dumps(payload)).json()
+        return self._post(url, data=json.dumps(payload))
 
     def listEditorConfigurations(self, identifier: CascadeIdentifier):
         url = f'{self.base_url}/api/v1/listEditorConfigurations/{identifier.type}/{identifier.id}'
         self.debug(f'Listing EditorConfigurations at {url}')
-        return self.session.get(url).json()
+        return self._get(url)
 
     def listMessages(self):
         url = f'{self.base_url}/api/v1/listMessages'
         self.debug(f'Listing Messages at {url}')
-        return self.session.get(url).json()
+        return self._get(url)
 
     def listSites(self):
         url = f'{self.base_url}/api/v1/listSites'
         self.debug(f'Listing Sites at {url}')
-        return self.session.get(url).json()
+        return self._get(url)
 
     def listSubscribers(self, identifier: CascadeIdentifier):
         url = f'{self.base_url}/api/v1/listSubscribers/{identifier.type}/{identifier.id}'
         self.debug(f'Listing Subscribers at {url}')
-        return self.session.get(url).json()
+        return self._get(url)
 
     def markMessage(self, identifier: CascadeIdentifier, markType: MessageMarkType):
         url = f'{self.base_url}/api/v1/markMessage/{identifier.type}/{identifier.id}'
         payload = {'markType': markType.value if hasattr(markType, 'value') else str(markType)}
         self.debug(f'MarkMessage payload: {payload}')
-        return self.session.post(url, data=json.dumps(payload)).json()
+        return self._post(url, data=json.dumps(payload))
 
     def move(self, identifier: CascadeIdentifier, moveParameters: MoveParameters, workflowConfiguration: WorkflowConfiguration=None):
         url = f'{self.base_url}/api/v1/move/{identifier.type}/{identifier.id}'
@@ -212,62 +321,86 @@ class CascadeCMSRestDriver:
         if workflowConfiguration:
             payload['workflowConfiguration'] = json.loads(workflowConfiguration.toJson())
         self.debug(f'Move payload: {payload}')
-        return self.session.post(url, data=json.dumps(payload)).json()
+        return self._post(url, data=json.dumps(payload))
 
     def performWorkflowTransition(self, workflowTransitionInformation: WorkflowTransitionInformation):
         url = f'{self.base_url}/api/v1/performWorkflowTransition'
         payload = {'workflowTransitionInformation': json.loads(workflowTransitionInformation.toJson())}
         self.debug(f'PerformWorkflowTransition payload: {payload}')
-        return self.session.post(url, data=json.dumps(payload)).json()
+        return self._post(url, data=json.dumps(payload))
 
     def publish(self, publishInformation: PublishInformation):
         ident = publishInformation.identifier
         url = f'{self.base_url}/api/v1/publish/{ident.type}/{ident.id}'
         payload = {'publishInformation': json.loads(publishInformation.toJson())}
         self.debug(f'Publish payload: {payload}')
-        return self.session.post(url, data=json.dumps(payload)).json()
+        return self._post(url, data=json.dumps(payload))
 
     def read(self, identifier: CascadeIdentifier):
-        url = f'{self.base_url}/api/v1/read/{identifier.type}/{identifier.id}'
-        self.debug(f'Reading asset at {url}')
-        return self.session.get(url).json()
+        return self._readResolved(identifier.type, identifier.id)
+
+    def uploadFile(self, asset: dict, source, chunkSize=CHUNK_SIZE):
+        """ Creates the file asset, or edits it when `asset` has an id, with its data
+        streamed from `source` (path, binary file object, bytes or mmap). """
+        url = f"{self.base_url}/api/v1/{'edit' if asset.get('id') else 'create'}"
+        self.debug(f"Uploading file {asset.get('path') or asset.get('name')} to {url}")
+        # listeners get the asset without its data, so the file's cached reads are dropped
+        return self._post(url, data=fileBody(asset, source, chunkSize), stream=True, notify={'asset': {'file': asset}})
+
+    def downloadFile(self, identifier: CascadeIdentifier, destination, chunkSize=CHUNK_SIZE):
+        """ Reads a file asset, writing its data to `destination` (path or binary file
+        object) as it arrives. Returns the read response without the data. """
+        assetId = self.resolver.rewrite(identifier.type, identifier.id)
+        url = f'{self.base_url}/api/v1/read/file/{assetId}'
+        self.debug(f'Downloading file at {url}')
+        with self._slot(), self._transferSession().get(url, stream=True) as response:
+            result = readFileResponse(response.iter_content(chunkSize), destination)
+        if assetId != identifier.id and not self.resolver.confirms(identifier.id, result):
+            # stale cached id: download again by path over what was written
+            self.resolver.invalidate(assetId)
+            if not isinstance(destination, (str, os.PathLike)):
+                destination.seek(0)
+                destination.truncate()
+            return self.downloadFile(identifier, destination, chunkSize)
+        self.resolver.learn('file', result)
+        return result
 
     def readAccessRights(self, identifier: CascadeIdentifier):
         url = f'{self.base_url}/api/v1/readAccessRights/{identifier.type}/{identifier.id}'
         self.debug(f'Reading access rights at {url}')
-        return self.session.get(url).json()
+        return self._get(url)
 
     def readAudits(self, auditParameters: AuditParameters):
         url = f'{self.base_url}/api/v1/readAudits/{auditParameters.identifier.type}/{auditParameters.identifier.id}'
         payload = {'auditParameters': json.loads(auditParameters.toJson())}
         self.debug(f'ReadAudits payload: {payload}')
-        return self.session.post(url, data=json.dumps(payload)).json()
+        return self._post(url, data=json.dumps(payload))
 
     def readPreferences(self):
         url = f'{self.base_url}/api/v1/readPreferences'
         self.debug(f'Reading preferences at {url}')
-        return self.session.get(url).json()
+        return self._get(url)
 
     def readWorkflowInformation(self, identifier: CascadeIdentifier):
         url = f'{self.base_url}/api/v1/readWorkflowInformation/{identifier.type}/{identifier.id}'
         self.debug(f'ReadWorkflowInformation at {url}')
-        return self.session.get(url).json()
+        return self._get(url)
 
     def readWorkflowSettings(self, identifier: CascadeIdentifier):
         url = f'{self.base_url}/api/v1/readWorkflowSettings/{identifier.type}/{identifier.id}'
         self.debug(f'ReadWorkflowSettings at {url}')
-        return self.session.get(url).json()
+        return self._get(url)
 
     def search(self, searchInformation: SearchInformation):
         url = f'{self.base_url}/api/v1/search'
         self.debug(f'Search payload: {searchInformation.payload}')
-        return self.session.post(url, data=json.dumps(searchInformation.payload)).json()
+        return self._post(url, data=json.dumps(searchInformation.payload))
 
     def sendMessage(self, message: Message):
         url = f'{self.base_url}/api/v1/sendMessage'
         payload = {'message': json.loads(message.toJson())}
         self.debug(f'SendMessage payload: {payload}')
-        return self.session.post(url, data=json.dumps(payload)).json()
+        return self._post(url, data=json.dumps(payload))
 
     def siteCopy(self, originalSiteId: str = '', originalSiteName: str = '', newSiteName: str = ''):
         url = f'{self.base_url}/api/v1/siteCopy'
@@ -277,6 +410,6 @@ class CascadeCMSRestDriver:
         elif originalSiteName:
             data['originalSiteName'] = originalSiteName
         self.debug(f'SiteCopy payload: {data}')
-        return self.session.post(url, data=json.dumps(data)).json()
+        return self._post(url, data=json.dumps(data))
 
 
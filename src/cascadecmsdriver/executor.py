@@ -0,0 +1,135 @@
+""" Site-sharded multi-process executor for jobs that touch every site. Each
+worker process builds its own driver (and so its own connection pool); the
+request rate limit and the progress/metrics channel live in the parent. """
+
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from .driver import CascadeCMSRestDriver
+
+# per-process state, set up by _initWorker
+_driver = None
+_limiter = None
+_events = None
+
+
+class SharedRateLimiter:
+    """ Spaces requests from all worker processes at least 1/rate seconds apart. """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self._next = multiprocessing.Value('d', 0.0)
+
+    def acquire(self):
+        with self._next.get_lock():
+            now = time.time()
+            slot = max(now, self._next.value)
+            self._next.value = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def report(**metrics):
+    """ Sends metrics from inside a job function to the parent's progress channel. """
+    if _events is not None:
+        _events.put(('metrics', None, metrics))
+
+
+def _initWorker(driverKwargs, limiter, events):
+    global _driver, _limiter, _events
+    kwargs = dict(driverKwargs)
+    baseUrl = kwargs.pop('base_url', None)
+    _driver = CascadeCMSRestDriver(**kwargs)
+    if baseUrl:
+        _driver.base_url = baseUrl
+    _limiter, _events = limiter, events
+    if limiter is not None:
+        send = _driver.session.request
+
+        def request(*args, **kw):
+            _limiter.acquire()
+            return send(*args, **kw)
+        _driver.session.request = request
+
+
+def _runJob(fn, index, site):
+    start = time.monotonic()
+    try:
+        result, error = fn(_driver, site), None
+    except Exception as e:
+        result, error = None, f'{type(e).__name__}: {e}'
+    _events.put(('done', site.get('id') if isinstance(site, dict) else site,
+                 {'seconds': time.monotonic() - start, 'error': error}))
+    return index, result, error
+
+
+class SiteExecutor:
+    """
+    Usage:
+        def fixSite(driver, site):
+            ...
+            return summary
+
+        executor = SiteExecutor({'organization_name': 'my-org', 'api_key': key}, processes=8, rate=20)
+        for site, summary, error in executor.run(fixSite):
+            ...
+
+    `fn` must be a module-level function so it can be sent to worker processes.
+    Results come back in the order of `sites` whatever order the workers finish in.
+    """
+
+    def __init__(self, driverKwargs, processes=4, rate=None, onProgress=None):
+        self.driverKwargs = driverKwargs
+        self.processes = processes
+        self.rate = rate
+        self.onProgress = onProgress
+        self.metrics = {'completed': 0, 'failed': 0, 'seconds': 0.0, 'reported': {}}
+
+    def listSites(self):
+        kwargs = dict(self.driverKwargs)
+        baseUrl = kwargs.pop('base_url', None)
+        driver = CascadeCMSRestDriver(**kwargs)
+        if baseUrl:
+            driver.base_url = baseUrl
+        return driver.listSites()['sites']
+
+    def _consume(self, events, stop):
+        while not (stop.is_set() and events.empty()):
+            try:
+                kind, site, data = events.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if kind == 'done':
+                self.metrics['completed'] += 1
+                self.metrics['seconds'] += data['seconds']
+                if data['error']:
+                    self.metrics['failed'] += 1
+            else:
+                for name, value in data.items():
+                    self.metrics['reported'][name] = self.metrics['reported'].get(name, 0) + value
+            if self.onProgress:
+                self.onProgress(kind, site, data)
+
+    def run(self, fn, sites=None):
+        """ Returns [(site, result, error)] in the order of `sites` (default: listSites). """
+        if sites is None:
+            sites = self.listSites()
+        limiter = SharedRateLimiter(self.rate) if self.rate else None
+        events = multiprocessing.Queue()
+        stop = threading.Event()
+        consumer = threading.Thread(target=self._consume, args=(events, stop), daemon=True)
+        consumer.start()
+        results = [None] * len(sites)
+        try:
+            with ProcessPoolExecutor(max_workers=self.processes, initializer=_initWorker,
+                                     initargs=(self.driverKwargs, limiter, events)) as pool:
+                futures = [pool.submit(_runJob, fn, index, site) for index, site in enumerate(sites)]
+                for future in futures:
+                    index, result, error = future.result()
+                    results[index] = (sites[index], result, error)
+        finally:
+            stop.set()
+            consumer.join()
+        return results
@@ -0,0 +1,239 @@
+""" Streaming site export to gzip-compressed NDJSON. Assets are read from the
+crawler and written in small flushes, so memory stays flat regardless of site
+size; an interrupted export resumes from its last flush. Can be run as
+`python -m cascadecmsdriver.export`. """
+
+import argparse
+import gzip
+import hashlib
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from .cmstypes import CascadeIdentifier
+from .crawler import FolderCrawler, matchesType, unwrapAsset
+from .lanes import carryLane
+from .snapshot import FORMAT, SnapshotIndex, contentHash, iterSnapshot
+
+MANIFEST = 'manifest.json'
+PROGRESS = 'progress.json'
+EXPORTED_IDS = 'exported.ids'
+INDEX = 'index.json'
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class SiteExporter:
+    """
+    Writes one JSON record per asset: {'type', 'key', 'id', 'path', 'hash', 'asset'}
+    where `key` is the property name the asset was read under and `hash` its
+    content hash. A SnapshotIndex with folder Merkle hashes is saved alongside.
+
+    With shardSize=None the export is the single file `outputPath`
+    (e.g. 'backup.ndjson.gz') and the bookkeeping files sit next to it with the
+    same prefix; otherwise `outputPath` is a directory of part-NNNNN.ndjson.gz
+    shards of at most shardSize records each. Every flush appends a complete
+    gzip member and then records its offset, so after a crash the partial tail
+    is cut off and export(root, resume=True) carries on from there. Without
+    resume, files left at `outputPath` by an earlier export are removed and
+    the export starts over; resuming a finished export raises FileExistsError.
+
+    The root folder (a site's root folder, for a site) is exported first, so
+    its own content and settings are part of the snapshot.
+    """
+
+    def __init__(self, driver, outputPath, shardSize=None, flushSize=500, types=(), maxWorkers=4):
+        self._driver = driver
+        self.outputPath = outputPath
+        self.shardSize = shardSize
+        self.flushSize = flushSize
+        self.types = types
+        self.maxWorkers = maxWorkers
+        if shardSize:
+            os.makedirs(outputPath, exist_ok=True)
+
+    def _file(self, name):
+        if self.shardSize:
+            return os.path.join(self.outputPath, name)
+        return f'{self.outputPath}.{name}'
+
+    def _shardPath(self, index):
+        if self.shardSize:
+            return os.path.join(self.outputPath, f'part-{index:05d}.ndjson.gz')
+        return self.outputPath
+
+    def _clear(self):
+        """ Removes the output and bookkeeping files of an earlier export to the same path. """
+        for name in (MANIFEST, PROGRESS, EXPORTED_IDS, INDEX):
+            if os.path.exists(self._file(name)):
+                os.remove(self._file(name))
+        index = 0
+        while os.path.exists(self._shardPath(index)):
+            os.remove(self._shardPath(index))
+            if not self.shardSize:
+                break
+            index += 1
+
+    def _loadProgress(self, rootId):
+        """ Restores the last checkpoint, cutting any partially written tail. """
+        state = {'format': FORMAT, 'root': rootId, 'shards': [{'records': 0, 'offset': 0}], 'idsOffset': 0, 'counts': {}, 'total': 0}
+        exported = set()
+        if os.path.exists(self._file(MANIFEST)):
+            raise FileExistsError(f'The export at {self.outputPath} is finished; export without resume to start over')
+        if os.path.exists(self._file(PROGRESS)):
+            with open(self._file(PROGRESS)) as f:
+                state = json.load(f)
+            if state.get('root', rootId) != rootId:
+                raise ValueError(f"The export at {self.outputPath} is of {state['root']}, not {rootId}")
+            if state.get('format', 1) != FORMAT:
+                raise ValueError(f'The export at {self.outputPath} was started by an older version; '
+                                 f'export without resume to start over')
+        current = len(state['shards']) - 1
+        shard = self._shardPath(current)
+        if os.path.exists(shard):
+            with open(shard, 'r+b') as f:
+                f.truncate(state['shards'][current]['offset'])
+        if self.shardSize:
+            index = current + 1
+            while os.path.exists(self._shardPath(index)):
+                os.remove(self._shardPath(index))
+                index += 1
+        if os.path.exists(self._file(EXPORTED_IDS)):
+            with open(self._file(EXPORTED_IDS), 'r+') as f:
+                f.truncate(state['idsOffset'])
+                f.seek(0)
+                exported = set(line.strip() for line in f if line.strip())
+        return state, exported
+
+    def _saveProgress(self, state):
+        tmp = self._file(PROGRESS) + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp, self._file(PROGRESS))
+
+    def _flush(self, state, buffer):
+        while buffer:
+            current = len(state['shards']) - 1
+            shard = state['shards'][current]
+            room = (self.shardSize - shard['records']) if self.shardSize else len(buffer)
+            if room <= 0:
+                state['shards'].append({'records': 0, 'offset': 0})
+                continue
+            chunk, buffer[:] = buffer[:room], buffer[room:]
+            path = self._shardPath(current)
+            with open(path, 'ab') as raw:
+                with gzip.GzipFile(fileobj=raw, mode='wb') as gz:
+                    for record in chunk:
+                        gz.write((json.dumps(record) + '\n').encode('utf-8'))
+            shard['records'] += len(chunk)
+            shard['offset'] = os.path.getsize(path)
+            with open(self._file(EXPORTED_IDS), 'a') as ids:
+                ids.write(''.join(f"{record['id']}\n" for record in chunk))
+            state['idsOffset'] = os.path.getsize(self._file(EXPORTED_IDS))
+            state['total'] += len(chunk)
+            for record in chunk:
+                state['counts'][record['type']] = state['counts'].get(record['type'], 0) + 1
+            self._saveProgress(state)
+
+    def _read(self, child):
+        response = self._driver.read(CascadeIdentifier(type=child['type'], id=child['id']))
+        key, asset = unwrapAsset(response)
+        if asset is None:
+            self._driver.error(f"Export could not read {child['type']} {child['id']}: {response.get('message')}")
+            return None
+        path = (child['path'] or {}).get('path') if 'path' in child else asset.get('path')
+        return {'type': child['type'], 'key': key, 'id': child['id'],
+                'path': path, 'hash': contentHash(asset), 'asset': asset}
+
+    def _rootFolder(self, root):
+        if isinstance(root, dict):
+            root = CascadeIdentifier(type=root['type'], id=root['id'])
+        if root.type == 'site':
+            return (unwrapAsset(self._driver.read(root))[1] or {}).get('rootFolderId')
+        return root.id
+
+    def export(self, root, resume=False):
+        """ Exports `root` (folder or site identifier) and everything under it, and returns
+        the manifest. With resume=True an interrupted export to the same path is continued. """
+        rootId = root['id'] if isinstance(root, dict) else root.id
+        if not resume:
+            self._clear()
+        state, exported = self._loadProgress(rootId)
+        if exported:
+            self._driver.info(f'Resuming export after {len(exported)} assets')
+        buffer = []
+        pending = set()
+
+        def collect(futures):
+            for future in futures:
+                record = future.result()
+                if record is not None:
+                    buffer.append(record)
+            if len(buffer) >= self.flushSize:
+                self._flush(state, buffer)
+
+        crawler = FolderCrawler(self._driver, types=self.types, maxWorkers=self.maxWorkers)
+        read = carryLane(self._driver, self._read)
+        # the crawl only yields descendants; the root folder's record carries no 'path' and takes the asset's
+        rootFolder = [{'type': 'folder', 'id': self._rootFolder(root)}] if matchesType('folder', self.types) else []
+        with ThreadPoolExecutor(max_workers=self.maxWorkers) as pool:
+            for child in itertools.chain(rootFolder, crawler.crawl(root)):
+                if child['id'] in exported:
+                    continue
+                if len(pending) >= self.maxWorkers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                pending.add(pool.submit(read, child))
+            collect(wait(pending).done)
+        self._flush(state, buffer)
+        return self._writeManifest(root, state)
+
+    def _writeManifest(self, root, state):
+        shards = []
+        for index, shard in enumerate(state['shards']):
+            path = self._shardPath(index)
+            if not os.path.exists(path):
+                continue
+            shards.append({'file': os.path.basename(path), 'records': shard['records'],
+                           'bytes': os.path.getsize(path), 'sha256': _sha256(path)})
+        # every record was hashed by this version (resuming an older export is refused)
+        index = SnapshotIndex.fromSnapshot(self.outputPath, trustHashes=True)
+        index.save(self._file(INDEX))
+        rootId = root['id'] if isinstance(root, dict) else root.id
+        manifest = {'format': FORMAT, 'root': rootId, 'finished': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                    'total': state['total'], 'counts': state['counts'], 'shards': shards,
+                    'index': os.path.basename(self._file(INDEX)), 'rootHash': index.rootHash}
+        with open(self._file(MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=2)
+        self._driver.info(f"Exported {state['total']} assets to {self.outputPath}")
+        return manifest
+
+
+def main():
+    from .driver import CascadeCMSRestDriver
+    parser = argparse.ArgumentParser(description='Export a Cascade CMS site to compressed NDJSON.')
+    parser.add_argument('--org', required=True, help='organization name, e.g. my-org')
+    parser.add_argument('--api-key', default=os.environ.get('CASCADE_API_KEY', ''))
+    parser.add_argument('--site', required=True, help='site id to export')
+    parser.add_argument('--out', required=True, help='output .ndjson.gz file, or directory with --shard-size')
+    parser.add_argument('--shard-size', type=int, default=None)
+    parser.add_argument('--flush-size', type=int, default=500)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--resume', action='store_true', help='continue an interrupted export to --out')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+    driver = CascadeCMSRestDriver(organization_name=args.org, api_key=args.api_key, verbose=args.verbose)
+    exporter = SiteExporter(driver, args.out, shardSize=args.shard_size, flushSize=args.flush_size, maxWorkers=args.workers)
+    manifest = exporter.export(CascadeIdentifier(type='site', id=args.site), resume=args.resume)
+    print(json.dumps({'total': manifest['total'], 'counts': manifest['counts']}))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+""" Streaming base64 handling for File asset data. Uploads encode the source in
+chunks straight into the JSON request body and downloads decode the `data`
+value straight to disk while the response is still arriving, so neither the
+raw bytes nor the base64 text of a large file is ever held in memory whole. """
+
+import base64
+import json
+import mmap
+import os
+import re
+import uuid
+
+# a multiple of 3 so every chunk encodes to base64 without padding
+CHUNK_SIZE = 3 * 256 * 1024
+
+_STRING_END = re.compile(rb'["\\]')
+_WHITESPACE = b' \t\r\n'
+
+
+def iterChunks(source, chunkSize=CHUNK_SIZE):
+    """ Yields raw chunks from a path (read through mmap), binary file object, bytes or mmap. """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                yield from iterChunks(mapped, chunkSize)
+        return
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        with memoryview(source) as view:
+            for offset in range(0, len(view), chunkSize):
+                yield view[offset:offset + chunkSize]
+        return
+    # file objects and mmaps; mmap.read copies one chunk at a time, so the map can be closed safely
+    while True:
+        chunk = source.read(chunkSize)
+        if not chunk:
+            return
+        yield chunk
+
+
+def iterBase64(source, chunkSize=CHUNK_SIZE):
+    for chunk in iterChunks(source, max(chunkSize - chunkSize % 3, 3)):
+        yield base64.b64encode(chunk)
+
+
+def fileBody(asset: dict, source, chunkSize=CHUNK_SIZE):
+    """ Yields the JSON body {'asset': {'file': asset}} with `data` encoded from `source` on the fly. """
+    marker = f'@@{uuid.uuid4().hex}@@'
+    head, tail = json.dumps({'asset': {'file': dict(asset, data=marker)}}).split(json.dumps(marker))
+    yield head.encode('utf-8') + b'"'
+    yield from iterBase64(source, chunkSize)
+    yield b'"' + tail.encode('utf-8')
+
+
+class Base64Sink:
+    """ Decodes base64 text fed in arbitrary pieces and writes whole 4 character groups to `out`. """
+
+    def __init__(self, out):
+        self.out = out
+        self.size = 0
+        self._pending = b''
+
+    def write(self, text: bytes):
+        text = self._pending + text
+        usable = len(text) - len(text) % 4
+        self._pending = text[usable:]
+        if usable:
+            self.size += self.out.write(base64.b64decode(text[:usable]))
+
+    def close(self):
+        if self._pending:
+            self.size += self.out.write(base64.b64decode(self._pending + b'=' * (-len(self._pending) % 4)))
+            self._pending = b''
+
+
+class FileResponseReader:
+    """
+    Incremental scanner for a read response. Everything except the string
+    value of the "data" key is collected as JSON text and parsed at the end
+    (with data set to null); the data value itself is passed to a Base64Sink.
+    A data value sent as a byte array instead of a string is left in the JSON
+    and written out by close().
+    """
+
+    def __init__(self, out):
+        self.sink = Base64Sink(out)
+        self.out = out
+        self.json = bytearray()
+        self._inString = False
+        self._inData = False
+        self._string = bytearray()
+        self._lastString = None
+        self._afterKey = False
+        self._stringEscape = False
+        self._escape = b''
+
+    def feed(self, chunk: bytes):
+        i = 0
+        while i < len(chunk):
+            if self._inData:
+                i = self._feedData(chunk, i)
+            elif self._inString:
+                i = self._feedString(chunk, i)
+            else:
+                char = chunk[i:i + 1]
+                i += 1
+                if char in _WHITESPACE:
+                    self.json += char
+                    continue
+                if self._afterKey and char == b'"':
+                    self._afterKey = False
+                    self._inData = True
+                    self.json += b'null'
+                    continue
+                self._afterKey = char == b':' and self._lastString == b'data'
+                self._lastString = None
+                if char == b'"':
+                    self._inString = True
+                    self._string = bytearray()
+                self.json += char
+
+    def _feedString(self, chunk, i):
+        if self._stringEscape:
+            # the backslash ended the previous chunk
+            self._stringEscape = False
+            self.json += chunk[i:i + 1]
+            return i + 1
+        match = _STRING_END.search(chunk, i)
+        end = match.start() if match else len(chunk)
+        self.json += chunk[i:end]
+        if len(self._string) <= 4:
+            # only short strings can be the "data" key
+            self._string += chunk[i:end][:5]
+        if not match:
+            return end
+        if chunk[end:end + 1] == b'\\':
+            self._string += b'\\'
+            self.json += chunk[end:end + 2]
+            self._stringEscape = end + 1 == len(chunk)
+            return end + 2
+        self.json += b'"'
+        self._inString = False
+        self._lastString = bytes(self._string)
+        return end + 1
+
+    def _feedData(self, chunk, i):
+        end = chunk.find(b'"', i)
+        text = self._escape + chunk[i:len(chunk) if end < 0 else end]
+        self._escape = b''
+        if text.endswith(b'\\'):
+            text, self._escape = text[:-1], b'\\'
+        # some servers escape '/' and wrap long base64 lines
+        self.sink.write(text.replace(b'\\/', b'/').replace(b'\\r', b'').replace(b'\\n', b''))
+        if end < 0:
+            return len(chunk)
+        self._inData = False
+        return end + 1
+
+    def close(self):
+        """ Flushes the decoded data and returns the parsed response. """
+        self.sink.close()
+        response = json.loads(bytes(self.json))
+        asset = (response.get('asset') or {}).get('file')
+        if asset and isinstance(asset.get('data'), list):
+            self.sink.size += self.out.write(bytes(b & 0xff for b in asset['data']))
+            asset['data'] = None
+        return response
+
+
+def readFileResponse(chunks, destination):
+    """ Writes the data of a streamed file read response to `destination` (path or
+    binary file object) and returns the response with asset.file.data set to None. """
+    out = open(destination, 'wb') if isinstance(destination, (str, os.PathLike)) else destination
+    try:
+        reader = FileResponseReader(out)
+        for chunk in chunks:
+            reader.feed(chunk)
+        response = reader.close()
+    finally:
+        if out is not destination:
+            out.close()
+    asset = (response.get('asset') or {}).get('file')
+    if asset is not None:
+        asset['size'] = reader.sink.size
+    return response
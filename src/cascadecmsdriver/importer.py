@@ -0,0 +1,219 @@
+""" Restores or clones content from an export snapshot. Creates run in
+dependency order (folders top-down, then files and formats, blocks, templates,
+pages, and symlinks and references) with each level created concurrently, and
+every reference to an asset created earlier in the import is rewritten to its
+new id. Assets that point at one created in the same or a later level, such as
+page-to-page links, are edited once everything exists. """
+
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from .lanes import carryLane
+from .snapshot import iterSnapshot
+
+# creation order; references into the same or a later level are fixed up by an edit afterwards
+LEVELS = (('folder',), ('file', 'format'), ('block',), ('template',), ('page',), ('symlink', 'reference'))
+
+# read-only or server-assigned properties that create must not receive
+READ_ONLY = ('id', 'path', 'parentFolderPath', 'children', 'lastModifiedDate', 'lastModifiedBy',
+             'createdDate', 'createdBy', 'lastPublishedDate', 'lastPublishedBy', 'siteName')
+
+
+def _baseType(assetType):
+    return assetType.split('_', 1)[0]
+
+
+class SnapshotImporter:
+    """
+    Usage:
+        importer = SnapshotImporter(driver, 'backup.ndjson.gz', destinationFolderId=folderId,
+                                    siteId=targetSiteId, idMapPath='restore-ids.json')
+        result = importer.run()          # or run(dryRun=True) to only plan
+
+    Assets whose parent folder is not in the snapshot are created in
+    `destinationFolderId`, and a site's root folder is not created at all:
+    its children go straight into `destinationFolderId`. With `idMapPath` every old -> new id pair is
+    appended to the map file as soon as its create succeeds, and assets
+    already in it are skipped, so a failed or interrupted import can be
+    re-run without creating anything twice. Assets created while an asset
+    they reference did not exist yet are edited again at the end with the
+    new ids; on a re-run that applies to skipped assets too.
+    """
+
+    def __init__(self, driver, snapshotPath, destinationFolderId, siteId=None, maxWorkers=4, idMapPath=None):
+        self._driver = driver
+        self.snapshotPath = snapshotPath
+        self.destinationFolderId = destinationFolderId
+        self.siteId = siteId
+        self.maxWorkers = maxWorkers
+        self.idMapPath = idMapPath
+        self.idMap = {}
+        if idMapPath and os.path.exists(idMapPath):
+            # one JSON object per line; a map saved as a single object is just one line
+            with open(idMapPath) as f:
+                for line in f:
+                    try:
+                        self.idMap.update(json.loads(line))
+                    except ValueError:
+                        # a torn final line from a crash
+                        continue
+
+    def _saveId(self, oldId, newId):
+        with open(self.idMapPath, 'a') as f:
+            f.write(json.dumps({oldId: newId}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _remap(self, value):
+        """ Rewrites every '<name>Id' that points at an imported asset and drops its '<name>Path'. """
+        if isinstance(value, list):
+            return [self._remap(v) for v in value]
+        if not isinstance(value, dict):
+            return value
+        remapped = {}
+        stalePaths = set()
+        for key, item in value.items():
+            if key.endswith('Id') and isinstance(item, str) and item in self.idMap:
+                remapped[key] = self.idMap[item]
+                stalePaths.add(key[:-2] + 'Path')
+            else:
+                remapped[key] = self._remap(item)
+        for key in stalePaths:
+            remapped.pop(key, None)
+        return remapped
+
+    def _references(self, value, snapshotIds):
+        """ Whether any '<name>Id' but the parent folder still points at an asset in the snapshot. """
+        stack = [value]
+        while stack:
+            value = stack.pop()
+            if isinstance(value, list):
+                stack.extend(value)
+            elif isinstance(value, dict):
+                for key, item in value.items():
+                    if key.endswith('Id') and key != 'parentFolderId' and isinstance(item, str) and item in snapshotIds:
+                        return True
+                    if isinstance(item, (dict, list)):
+                        stack.append(item)
+        return False
+
+    def payload(self, record, snapshotIds):
+        asset = {k: v for k, v in record['asset'].items() if k not in READ_ONLY}
+        if asset.get('parentFolderId') not in snapshotIds:
+            asset['parentFolderId'] = self.destinationFolderId
+        if self.siteId:
+            asset['siteId'] = self.siteId
+        return {'asset': {record['key']: self._remap(asset)}}
+
+    def _create(self, record, snapshotIds, dryRun):
+        payload = self.payload(record, snapshotIds)
+        # the payload itself tells, since other creates of this level may finish meanwhile
+        unresolved = self._references(payload, snapshotIds)
+        if dryRun:
+            return record, f"dry-run:{record['id']}", payload, unresolved
+        response = self._driver.create(payload)
+        if response.get('success') in (True, 'true') and response.get('createdAssetId'):
+            return record, response['createdAssetId'], None, unresolved
+        return record, None, response.get('message', 'create failed'), unresolved
+
+    def _edit(self, record, snapshotIds, dryRun):
+        payload = self.payload(record, snapshotIds)
+        payload['asset'][record['key']]['id'] = self.idMap[record['id']]
+        if dryRun:
+            return record, True, payload
+        response = self._driver.edit(payload)
+        if response.get('success') in (True, 'true'):
+            return record, True, None
+        return record, False, response.get('message', 'edit failed')
+
+    def _relink(self, relinkIds, snapshotIds, dryRun, result):
+        """ Edits assets created before some asset they reference, now that every new id is known. """
+        pending = set()
+
+        def collect(futures):
+            for future in futures:
+                record, ok, detail = future.result()
+                if not ok:
+                    result['failed'].append({'id': record['id'], 'path': record.get('path'), 'message': detail})
+                    self._driver.error(f"Relinking {record['type']} {record.get('path')} failed: {detail}")
+                    continue
+                result['relinked'] += 1
+                if dryRun:
+                    result['plan'].append({'type': record['type'], 'path': record.get('path'), 'payload': detail,
+                                           'edit': True})
+
+        edit = carryLane(self._driver, self._edit)
+        with ThreadPoolExecutor(max_workers=self.maxWorkers) as pool:
+            for record in iterSnapshot(self.snapshotPath):
+                if record['id'] not in relinkIds:
+                    continue
+                if len(pending) >= self.maxWorkers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                pending.add(pool.submit(edit, record, snapshotIds, dryRun))
+            collect(wait(pending).done)
+
+    def _runLevel(self, records, snapshotIds, dryRun, result, relinkIds):
+        pending = set()
+
+        def collect(futures):
+            for future in futures:
+                record, newId, detail, unresolved = future.result()
+                if newId is None:
+                    result['failed'].append({'id': record['id'], 'path': record.get('path'), 'message': detail})
+                    self._driver.error(f"Import of {record['type']} {record.get('path')} failed: {detail}")
+                    continue
+                self.idMap[record['id']] = newId
+                if self.idMapPath and not dryRun:
+                    self._saveId(record['id'], newId)
+                if unresolved:
+                    relinkIds.add(record['id'])
+                result['created'] += 1
+                if dryRun:
+                    result['plan'].append({'type': record['type'], 'path': record.get('path'), 'payload': detail})
+
+        create = carryLane(self._driver, self._create)
+        with ThreadPoolExecutor(max_workers=self.maxWorkers) as pool:
+            for record in records:
+                if record['id'] in self.idMap and not dryRun:
+                    result['skipped'] += 1
+                    # whether an interrupted run already relinked it is not recorded; the edit is harmless twice
+                    if self._references(record['asset'], snapshotIds):
+                        relinkIds.add(record['id'])
+                    continue
+                if len(pending) >= self.maxWorkers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                pending.add(pool.submit(create, record, snapshotIds, dryRun))
+            collect(wait(pending).done)
+
+    def run(self, dryRun=False):
+        """ Returns {'created', 'skipped', 'relinked', 'failed', 'idMap'} and, for dry runs, the planned payloads. """
+        result = {'created': 0, 'skipped': 0, 'relinked': 0, 'failed': [], 'plan': []}
+        relinkIds = set()
+        savedMap = dict(self.idMap)
+        snapshotIds = set()
+        folderDepths = {}
+        for record in iterSnapshot(self.snapshotPath):
+            snapshotIds.add(record['id'])
+            if record['type'] == 'folder' and not record['asset'].get('parentFolderId'):
+                # a site's root folder
+                self.idMap[record['id']] = self.destinationFolderId
+            elif record['type'] == 'folder':
+                folderDepths[record['id']] = (record.get('path') or '').count('/')
+        # folders one depth at a time so parents always exist before their children
+        for depth in sorted(set(folderDepths.values())):
+            records = (r for r in iterSnapshot(self.snapshotPath) if folderDepths.get(r['id']) == depth)
+            self._runLevel(records, snapshotIds, dryRun, result, relinkIds)
+        for types in LEVELS[1:]:
+            records = (r for r in iterSnapshot(self.snapshotPath) if _baseType(r['type']) in types)
+            self._runLevel(records, snapshotIds, dryRun, result, relinkIds)
+        self._relink(relinkIds, snapshotIds, dryRun, result)
+        self._driver.info(f"Import {'planned' if dryRun else 'finished'}: {result['created']} created, "
+                          f"{result['skipped']} skipped, {result['relinked']} relinked, "
+                          f"{len(result['failed'])} failed")
+        result['idMap'] = dict(self.idMap)
+        if dryRun:
+            # placeholder ids only exist to plan reference rewrites
+            self.idMap = savedMap
+        return result
@@ -0,0 +1,113 @@
+""" Request priority lanes. One driver instance can serve interactive requests
+and long bulk jobs at once; every HTTP call takes a slot from a fixed capacity,
+waiting requests of higher lanes are always served first, and part of the
+capacity is held back for the interactive lane so it never queues behind bulk
+traffic. Lower lanes never take the reserved slots, even while the higher
+lanes are idle, so bulk jobs run on the rest of the capacity. """
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+LANE_INTERACTIVE = 'interactive'
+LANE_BULK = 'bulk'
+LANE_BACKGROUND = 'background'
+# highest priority first
+LANES = (LANE_INTERACTIVE, LANE_BULK, LANE_BACKGROUND)
+
+
+class PriorityLanes:
+    """
+    Usage:
+        lanes = PriorityLanes(capacity=10, reserve={'interactive': 3})
+        with lanes.slot('bulk'):
+            session.get(url)
+        lanes.stats()       # per lane: requests, waiting, active, mean/p95/max queue wait
+
+    `reserve` maps a lane to slots only it and higher lanes may use: a
+    request in a lower lane only starts while more slots are free than all
+    higher lanes reserve. By default a quarter of the capacity (at least one
+    slot) is reserved for the first lane.
+    """
+    # queue waits kept per lane for the percentiles in stats()
+    SAMPLES = 1000
+
+    def __init__(self, capacity=10, lanes=LANES, reserve=None):
+        self.capacity = capacity
+        self.lanes = tuple(lanes)
+        if reserve is None:
+            reserve = {self.lanes[0]: max(1, capacity // 4)}
+        # free slots that must remain after a request of each lane starts
+        self._headroom = {lane: sum(reserve.get(higher, 0) for higher in self.lanes[:i])
+                          for i, lane in enumerate(self.lanes)}
+        if max(self._headroom.values()) >= capacity:
+            raise ValueError(f'Reserved slots {reserve} leave no capacity for {self.lanes[-1]!r} out of {capacity}')
+        self._cond = threading.Condition()
+        self._waiting = {lane: deque() for lane in self.lanes}
+        self._active = {lane: 0 for lane in self.lanes}
+        self._requests = {lane: 0 for lane in self.lanes}
+        self._totalWait = {lane: 0.0 for lane in self.lanes}
+        self._maxWait = {lane: 0.0 for lane in self.lanes}
+        self._waits = {lane: deque(maxlen=PriorityLanes.SAMPLES) for lane in self.lanes}
+
+    def _canStart(self, lane, ticket):
+        if self._waiting[lane][0] is not ticket:
+            return False
+        if self.capacity - sum(self._active.values()) <= self._headroom[lane]:
+            return False
+        # anything waiting in a higher lane goes first
+        return not any(self._waiting[higher] for higher in self.lanes[:self.lanes.index(lane)])
+
+    @contextmanager
+    def slot(self, lane=None):
+        lane = lane or self.lanes[0]
+        if lane not in self._waiting:
+            raise ValueError(f'Unknown lane {lane!r}, expected one of {self.lanes}')
+        ticket = object()
+        start = time.monotonic()
+        with self._cond:
+            self._waiting[lane].append(ticket)
+            while not self._canStart(lane, ticket):
+                self._cond.wait()
+            self._waiting[lane].popleft()
+            self._active[lane] += 1
+            waited = time.monotonic() - start
+            self._requests[lane] += 1
+            self._totalWait[lane] += waited
+            self._maxWait[lane] = max(self._maxWait[lane], waited)
+            self._waits[lane].append(waited)
+            # the next ticket in this lane may be able to start too
+            self._cond.notify_all()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active[lane] -= 1
+                self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            stats = {}
+            for lane in self.lanes:
+                waits = sorted(self._waits[lane])
+                requests = self._requests[lane]
+                stats[lane] = {'requests': requests, 'waiting': len(self._waiting[lane]), 'active': self._active[lane],
+                               'meanWait': self._totalWait[lane] / requests if requests else 0.0,
+                               'p95Wait': waits[int(len(waits) * 0.95)] if waits else 0.0,
+                               'maxWait': self._maxWait[lane]}
+            return stats
+
+
+def carryLane(driver, fn):
+    """ Wraps `fn` so it runs in the caller's lane when called from pool threads,
+    which do not inherit the thread-local lane. """
+    currentLane = getattr(driver, 'currentLane', None)
+    if currentLane is None:
+        return fn
+    lane = currentLane()
+
+    def run(*args, **kwargs):
+        with driver.lane(lane):
+            return fn(*args, **kwargs)
+    return run
@@ -0,0 +1,237 @@
+""" Staged producer/consumer pipeline for chaining driver calls (read ->
+transform -> edit -> publish) with per-stage concurrency, bounded queues
+between stages and per-stage throughput / queue depth metrics. """
+
+import queue
+import threading
+import time
+from .cmstypes import CascadeIdentifier
+from .crawler import unwrapAsset
+
+_DONE = object()
+# seconds between checks of the stop flag while waiting on a full or empty queue
+_POLL = 0.1
+
+
+def _put(q, item, stop):
+    """ Queue.put that gives up once `stop` is set; returns whether the item went in. """
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=_POLL)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q, stop):
+    """ Queue.get that returns _DONE once `stop` is set. """
+    while not stop.is_set():
+        try:
+            return q.get(timeout=_POLL)
+        except queue.Empty:
+            continue
+    return _DONE
+
+
+class StageMetrics:
+    def __init__(self):
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.busySeconds = 0.0
+        self.maxQueueDepth = 0
+        self._lock = threading.Lock()
+
+    def add(self, elapsed, outcome):
+        with self._lock:
+            self.busySeconds += elapsed
+            if outcome == 'error':
+                self.errors += 1
+            elif outcome == 'dropped':
+                self.dropped += 1
+            else:
+                self.processed += 1
+
+
+class Stage:
+    """
+    One step of a Pipeline. `fn` receives an item and returns the item to hand
+    to the next stage, or None to drop it. `queueSize` bounds the input queue of
+    this stage, so a slow stage blocks the stages feeding it instead of letting
+    work pile up in memory.
+    """
+
+    def __init__(self, name, fn, concurrency=1, queueSize=100):
+        self.name = name
+        self.fn = fn
+        self.concurrency = concurrency
+        self.queueSize = queueSize
+        self.metrics = StageMetrics()
+        self.inbox = None
+
+
+class Pipeline:
+    def __init__(self, stages, onError=None):
+        self.stages = list(stages)
+        self.onError = onError
+        self._started = None
+
+    def _worker(self, stage, outbox, remaining, lock, stop):
+        while True:
+            item = _get(stage.inbox, stop)
+            if item is _DONE:
+                break
+            depth = stage.inbox.qsize()
+            if depth > stage.metrics.maxQueueDepth:
+                stage.metrics.maxQueueDepth = depth
+            start = time.monotonic()
+            try:
+                result = stage.fn(item)
+                outcome = 'dropped' if result is None else 'ok'
+            except Exception as e:
+                result, outcome = None, 'error'
+                if self.onError:
+                    self.onError(stage.name, item, e)
+            stage.metrics.add(time.monotonic() - start, outcome)
+            if result is not None:
+                outbox.put(result)
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            outbox.put(_DONE)
+
+    def run(self, items, outputQueueSize=100):
+        """ Feeds `items` through every stage and yields what comes out of the
+        last one. Results arrive as soon as each item clears the pipeline. If
+        `items` raises, the items already fed still come out, then the error
+        is raised here. Breaking out of the loop (or closing the generator)
+        stops the feeder and the workers once their current item is done. """
+        self._started = time.monotonic()
+        for stage in self.stages:
+            stage.inbox = queue.Queue(maxsize=stage.queueSize)
+        output = queue.Queue(maxsize=outputQueueSize)
+        stop = threading.Event()
+        threads = []
+        for index, stage in enumerate(self.stages):
+            outbox = self.stages[index + 1].inbox if index + 1 < len(self.stages) else output
+            # each stage forwards one _DONE per downstream worker once all of its own workers exit
+            remaining, lock = [stage.concurrency], threading.Lock()
+            for _ in range(stage.concurrency):
+                fanout = _Fanout(outbox, self._downstreamWorkers(index), stop)
+                t = threading.Thread(target=self._worker, args=(stage, fanout, remaining, lock, stop), daemon=True)
+                t.start()
+                threads.append(t)
+
+        feedError = []
+
+        def feed():
+            first = self.stages[0]
+            try:
+                for item in items:
+                    if not _put(first.inbox, item, stop):
+                        break
+            except Exception as e:
+                feedError.append(e)
+            finally:
+                # always shut the stages down, or the consumer below would wait forever
+                for _ in range(first.concurrency):
+                    _put(first.inbox, _DONE, stop)
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+
+        try:
+            while True:
+                result = output.get()
+                if result is _DONE:
+                    break
+                yield result
+        finally:
+            # a no-op after a normal finish; after a break it unblocks every thread on a full queue
+            stop.set()
+            for t in threads:
+                t.join()
+            feeder.join()
+        if feedError:
+            raise feedError[0]
+
+    def _downstreamWorkers(self, index):
+        return self.stages[index + 1].concurrency if index + 1 < len(self.stages) else 1
+
+    def metrics(self):
+        """ Per-stage snapshot. The stage with the highest utilisation (busy time
+        per worker over wall-clock time) is the bottleneck. """
+        elapsed = time.monotonic() - self._started if self._started else 0.0
+        report = {}
+        for stage in self.stages:
+            m = stage.metrics
+            report[stage.name] = {
+                'processed': m.processed,
+                'dropped': m.dropped,
+                'errors': m.errors,
+                'throughput': (m.processed / elapsed) if elapsed else 0.0,
+                'utilisation': (m.busySeconds / (elapsed * stage.concurrency)) if elapsed else 0.0,
+                'queueDepth': stage.inbox.qsize() if stage.inbox else 0,
+                'maxQueueDepth': m.maxQueueDepth,
+            }
+        return report
+
+    def bottleneck(self):
+        report = self.metrics()
+        return max(report, key=lambda name: report[name]['utilisation']) if report else None
+
+
+class _Fanout:
+    """ Output side of a stage: forwards items, and turns the single end marker
+    into one marker per downstream worker. """
+
+    def __init__(self, outbox, downstreamWorkers, stop):
+        self.outbox = outbox
+        self.downstreamWorkers = downstreamWorkers
+        self.stop = stop
+
+    def put(self, item):
+        if item is _DONE:
+            for _ in range(self.downstreamWorkers):
+                _put(self.outbox, _DONE, self.stop)
+        else:
+            _put(self.outbox, item, self.stop)
+
+
+def _identifier(item):
+    if isinstance(item, CascadeIdentifier):
+        return item
+    return CascadeIdentifier(type=item['type'], id=item['id'])
+
+
+def readStage(driver, concurrency=4, queueSize=100):
+    """ identifier -> read response asset dict, None on failure. The asset's property
+    name ('page', 'xhtmlDataDefinitionBlock', ...) is kept under 'type' for editStage. """
+    def read(item):
+        key, asset = unwrapAsset(driver.read(_identifier(item)))
+        if asset is None:
+            return None
+        asset['type'] = key
+        return asset
+    return Stage('read', read, concurrency, queueSize)
+
+
+def editStage(driver, concurrency=2, queueSize=100):
+    """ asset dict (with 'type') -> same asset if the edit succeeded """
+    def edit(asset):
+        assetType = asset.pop('type')
+        status = driver.edit({'asset': {assetType: asset}})
+        asset['type'] = assetType
+        if status.get('success') in (True, 'true'):
+            return asset
+        raise RuntimeError(status.get('message', 'edit failed'))
+    return Stage('edit', edit, concurrency, queueSize)
+
+
+def publishStage(driver, concurrency=1, queueSize=100):
+    """ asset dict or identifier -> publish response """
+    def publish(item):
+        identifier = _identifier(item)
+        return driver.publish_asset(asset_type=identifier.type, asset_identifier=identifier.id)
+    return Stage('publish', publish, concurrency, queueSize)
@@ -0,0 +1,150 @@
+""" Publish coalescing scheduler. Collects publish intents over a window,
+removes duplicates, collapses many siblings into one publish of their parent
+folder and submits the result through a throttled priority queue. """
+
+import heapq
+import itertools
+import threading
+from .throttle import RateLimiter
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 9
+
+
+class PublishIntent:
+    def __init__(self, assetType, assetId, parentFolderId=None, destinations=(), priority=PRIORITY_NORMAL, unpublish=False):
+        self.assetType = assetType
+        self.assetId = assetId
+        self.parentFolderId = parentFolderId
+        self.destinations = tuple(sorted(destinations))
+        self.priority = priority
+        self.unpublish = unpublish
+
+    @property
+    def key(self):
+        return (self.assetType, self.assetId, self.destinations, self.unpublish)
+
+    def publishInformation(self):
+        info = {'unpublish': self.unpublish}
+        if self.destinations:
+            info['destinations'] = [{'type': 'destination', 'id': d} for d in self.destinations]
+        return {'publishInformation': info}
+
+
+class PublishScheduler:
+    """
+    Usage:
+        scheduler = PublishScheduler(driver, siblingThreshold=10, rate=0.5)
+        for page in edited:
+            scheduler.add('page', page['id'], parentFolderId=page['parentFolderId'])
+        scheduler.flush()
+
+    or start() it to flush every `window` seconds in the background. Intents
+    with the same asset, destinations and unpublish flag are merged (keeping the
+    highest priority). When `siblingThreshold` or more publish intents share a
+    parent folder and destinations they are replaced by a single folder
+    publish. Publish intents for assets inside a folder that is itself being
+    published are dropped. Unpublish intents are never coalesced or dropped:
+    unpublishing the folder would also take down the siblings nobody asked
+    to remove, so they are always sent one asset at a time. Jobs are submitted lowest priority number first, at most `rate`
+    per second.
+    """
+
+    def __init__(self, driver, window=30.0, siblingThreshold=10, rate=1.0, burst=1):
+        self._driver = driver
+        self.window = window
+        self.siblingThreshold = siblingThreshold
+        self.limiter = RateLimiter(rate, burst)
+        self._pending = {}
+        self._queue = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.results = []
+        self.stats = {'intents': 0, 'duplicates': 0, 'collapsed': 0, 'submitted': 0}
+
+    def add(self, assetType, assetId, parentFolderId=None, destinations=(), priority=PRIORITY_NORMAL, unpublish=False):
+        intent = PublishIntent(assetType, assetId, parentFolderId, destinations, priority, unpublish)
+        with self._lock:
+            self.stats['intents'] += 1
+            existing = self._pending.get(intent.key)
+            if existing is not None:
+                self.stats['duplicates'] += 1
+                existing.priority = min(existing.priority, intent.priority)
+                existing.parentFolderId = existing.parentFolderId or intent.parentFolderId
+            else:
+                self._pending[intent.key] = intent
+
+    def _coalesce(self, intents):
+        # collapse crowded sibling groups into a publish of their parent folder; unpublishes stay per asset
+        groups = {}
+        for intent in intents:
+            if intent.parentFolderId and intent.assetType != 'folder' and not intent.unpublish:
+                groups.setdefault((intent.parentFolderId, intent.destinations), []).append(intent)
+        byKey = {intent.key: intent for intent in intents}
+        for (folderId, destinations), siblings in groups.items():
+            if len(siblings) < self.siblingThreshold:
+                continue
+            for sibling in siblings:
+                del byKey[sibling.key]
+            self.stats['collapsed'] += len(siblings)
+            folder = PublishIntent('folder', folderId, None, destinations, min(s.priority for s in siblings))
+            if folder.key in byKey:
+                byKey[folder.key].priority = min(byKey[folder.key].priority, folder.priority)
+            else:
+                byKey[folder.key] = folder
+        # anything whose parent folder is already being published is covered by it
+        folders = {(i.assetId, i.destinations) for i in byKey.values() if i.assetType == 'folder' and not i.unpublish}
+        return [i for i in byKey.values() if i.unpublish or (i.parentFolderId, i.destinations) not in folders]
+
+    def flush(self):
+        """ Coalesces everything collected so far into the submit queue. Without a
+        background thread the queue is drained immediately. """
+        with self._lock:
+            intents = list(self._pending.values())
+            self._pending.clear()
+        jobs = self._coalesce(intents)
+        # group by destination set so each destination's jobs go out together
+        jobs.sort(key=lambda i: (i.priority, i.destinations))
+        with self._lock:
+            for job in jobs:
+                heapq.heappush(self._queue, (job.priority, next(self._sequence), job))
+        self._driver.debug(f'Publish scheduler queued {len(jobs)} jobs from {len(intents)} intents')
+        if self._thread is None:
+            return self.drain()
+        return []
+
+    def drain(self):
+        results = []
+        while True:
+            with self._lock:
+                if not self._queue:
+                    break
+                _, _, job = heapq.heappop(self._queue)
+            self.limiter.acquire()
+            response = self._driver.publish_asset(asset_type=job.assetType, asset_identifier=job.assetId,
+                                                  publish_information=job.publishInformation())
+            self.stats['submitted'] += 1
+            results.append((job, response))
+        self.results.extend(results)
+        return results
+
+    def _loop(self):
+        while not self._stop.wait(self.window):
+            self.flush()
+            self.drain()
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Stops the background thread and submits whatever is still pending. """
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        return self.flush()
@@ -0,0 +1,183 @@
+""" Path -> identifier resolution cache. Learns (site, path) -> id pairs from
+every read the driver performs, including the `children` of folders, so reads
+addressed by path inside an already visited subtree can be sent by id. """
+
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from .cache import decodeBody
+from .cmstypes import CascadeIdentifier
+from .crawler import unwrapAsset
+from .lanes import LANE_BACKGROUND
+
+
+class PathResolver:
+    """
+    Attached to a CascadeCMSRestDriver as `driver.resolver`. With
+    prefetch=True, reading a folder also schedules background reads of its
+    child folders so that the next level down is warm before it is asked for.
+
+    Mappings are forgotten after `maxAge` seconds, when this driver moves or
+    deletes the asset, and when a read by the cached id comes back for another
+    path or not at all (see confirms()), so moves made elsewhere heal too.
+    """
+    # write endpoints that can change the path of an asset (and of everything below it);
+    # renames also go through move
+    PATH_CHANGING = ('move', 'delete')
+
+    def __init__(self, maxEntries=200000, prefetch=False, prefetchWorkers=2, recentFolders=32, maxAge=3600):
+        self.maxEntries = maxEntries
+        self.maxAge = maxAge
+        self.prefetchEnabled = prefetch
+        self._paths = OrderedDict()
+        self._ids = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._prefetched = set()
+        self._recent = deque(maxlen=recentFolders)
+        self._pool = ThreadPoolExecutor(max_workers=prefetchWorkers) if prefetch else None
+        self._driver = None
+        self.hits = 0
+        self.misses = 0
+
+    def attach(self, driver):
+        self._driver = driver
+        driver.writeListeners.append(self.onWrite)
+        return self
+
+    @staticmethod
+    def splitIdentifier(assetIdentifier):
+        """ 'site-name/content/tree' -> ('site-name', 'content/tree'); None for ids. """
+        if not isinstance(assetIdentifier, str) or '/' not in assetIdentifier:
+            return None
+        siteName, _, path = assetIdentifier.strip('/').partition('/')
+        return siteName, path
+
+    def _remember(self, siteName, path, assetType, assetId):
+        if not siteName or path is None or not assetId:
+            return
+        key = (siteName, path.strip('/'))
+        with self._lock:
+            self._paths[key] = (assetType, assetId, time.monotonic())
+            self._paths.move_to_end(key)
+            self._ids[assetId] = key
+            while len(self._paths) > self.maxEntries:
+                _, (_, evictedId, _) = self._paths.popitem(last=False)
+                self._ids.pop(evictedId, None)
+
+    def resolve(self, siteName, path, assetType=None):
+        """ Returns the CascadeIdentifier for a path without any network call, or None. """
+        with self._lock:
+            entry = self._paths.get((siteName, path.strip('/')))
+            if entry is not None and self.maxAge is not None and time.monotonic() - entry[2] > self.maxAge:
+                del self._paths[(siteName, path.strip('/'))]
+                self._ids.pop(entry[1], None)
+                entry = None
+            if entry is None or (assetType is not None and entry[0] != assetType):
+                self.misses += 1
+                return None
+            self._paths.move_to_end((siteName, path.strip('/')))
+            self.hits += 1
+        return CascadeIdentifier(type=entry[0], id=entry[1])
+
+    def rewrite(self, assetType, assetIdentifier):
+        """ Swaps a path identifier for the cached id when one is known. """
+        split = PathResolver.splitIdentifier(assetIdentifier)
+        if split is None:
+            return assetIdentifier
+        identifier = self.resolve(split[0], split[1], assetType)
+        return identifier.id if identifier is not None else assetIdentifier
+
+    def confirms(self, assetIdentifier, response):
+        """ True when a read sent by the cached id of path `assetIdentifier` returned
+        the asset still living at that path. """
+        split = PathResolver.splitIdentifier(assetIdentifier)
+        asset = unwrapAsset(response)[1]
+        if split is None or asset is None:
+            return split is None
+        return asset.get('siteName') in (None, split[0]) and (asset.get('path') or '').strip('/') == split[1]
+
+    def learn(self, assetType, response):
+        """ Records the asset in a read response and, for containers, its children. """
+        asset = unwrapAsset(response)[1]
+        if asset is None:
+            return
+        siteName = asset.get('siteName')
+        self._remember(siteName, asset.get('path'), assetType, asset.get('id'))
+        childFolders = []
+        for child in asset.get('children', []):
+            path = child.get('path') or {}
+            self._remember(path.get('siteName', siteName), path.get('path'), child.get('type'), child.get('id'))
+            if child.get('type') == 'folder':
+                childFolders.append(child['id'])
+        if assetType == 'folder' and self.prefetchEnabled and not getattr(self._local, 'prefetching', False):
+            self._recent.append(asset.get('id'))
+            self._prefetch(childFolders)
+
+    def _prefetch(self, folderIds):
+        for folderId in folderIds:
+            with self._lock:
+                if folderId in self._prefetched:
+                    continue
+                self._prefetched.add(folderId)
+            self._pool.submit(self._prefetchOne, folderId)
+
+    def _prefetchOne(self, folderId):
+        # reads made here only learn; they do not schedule another level of prefetching
+        self._local.prefetching = True
+        try:
+            # speculative reads must not hold up anyone's real requests
+            with self._driver.lane(LANE_BACKGROUND):
+                self._driver.read(CascadeIdentifier(type='folder', id=folderId))
+        except Exception as e:
+            self._driver.debug(f'Prefetch of folder {folderId} failed: {e}')
+        finally:
+            self._local.prefetching = False
+
+    def recentFolders(self):
+        return list(self._recent)
+
+    def onWrite(self, url, data=None):
+        parts = url.split('/api/v1/', 1)[-1].split('/')
+        if parts[0] in PathResolver.PATH_CHANGING and len(parts) >= 3:
+            self._forget('/'.join(parts[2:]))
+        elif parts[0] == 'batch':
+            payload = decodeBody(data)
+            for operation in (payload or {}).get('operations', []) if isinstance(payload, dict) else []:
+                for name in PathResolver.PATH_CHANGING:
+                    identifier = (operation.get(name) or {}).get('identifier') or {}
+                    path = identifier.get('path') or {}
+                    if identifier.get('id'):
+                        self._forget(identifier['id'])
+                    elif path.get('siteName') and path.get('path'):
+                        self._forget(f"{path['siteName']}/{path['path']}")
+
+    def _forget(self, assetIdentifier):
+        """ invalidate() for an id or a 'site-name/path' identifier. """
+        split = PathResolver.splitIdentifier(assetIdentifier)
+        if split is None:
+            self.invalidate(assetIdentifier)
+            return
+        with self._lock:
+            entry = self._paths.get((split[0], split[1].strip('/')))
+        if entry is not None:
+            self.invalidate(entry[1])
+
+    def invalidate(self, assetId=None):
+        """ Forgets an asset's path and every path below it, or everything. """
+        with self._lock:
+            if assetId is None:
+                self._paths.clear()
+                self._ids.clear()
+                self._prefetched.clear()
+                return
+            key = self._ids.pop(assetId, None)
+            self._prefetched.discard(assetId)
+            if key is None:
+                return
+            siteName, path = key
+            for other in [k for k in self._paths if k[0] == siteName and (k[1] == path or k[1].startswith(path + '/'))]:
+                _, otherId, _ = self._paths.pop(other)
+                self._ids.pop(otherId, None)
+                self._prefetched.discard(otherId)
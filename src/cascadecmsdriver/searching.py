@@ -0,0 +1,116 @@
+""" Sharded parallel search with a TTL result cache. A query is split by search
+type, site and/or search field, the shards run concurrently and merged,
+de-duplicated matches are yielded as each shard returns. """
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from .cmstypes import SearchInformation
+from .lanes import carryLane
+
+# searched when sharding by type and the query does not list its own types
+DEFAULT_SEARCH_TYPES = ('page', 'file', 'folder', 'block', 'format', 'template', 'symlink')
+
+
+class SearchCache:
+    """
+    Search results keyed by SearchInformation.normalizedKey(). Entries expire
+    after `expireAfter` seconds, and the whole cache is invalidated whenever the
+    driver it is attached to issues a write.
+    """
+
+    def __init__(self, expireAfter=300):
+        self.expireAfter = expireAfter
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def attach(self, driver):
+        driver.writeListeners.append(self.invalidate)
+        return self
+
+    def get(self, searchInformation):
+        key = searchInformation.normalizedKey()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1]
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+
+    def put(self, searchInformation, matches):
+        with self._lock:
+            self._entries[searchInformation.normalizedKey()] = (time.monotonic() + self.expireAfter, matches)
+
+    def invalidate(self, url=None, data=None):
+        with self._lock:
+            self._entries.clear()
+
+
+class ShardedSearch:
+    """
+    Usage:
+        search = ShardedSearch(driver, cache=SearchCache().attach(driver))
+        for match in search.stream(SearchInformation('tuition', ['xml'], []), shardBy=('type', 'site')):
+            ...
+    """
+    SHARD_KEYS = ('type', 'site', 'field')
+
+    def __init__(self, driver, cache=None, maxWorkers=4, sites=None):
+        self._driver = driver
+        self.cache = cache
+        self.maxWorkers = maxWorkers
+        self._sites = sites
+
+    def sites(self):
+        if self._sites is None:
+            self._sites = [s['id'] for s in self._driver.listSites().get('sites', [])]
+        return self._sites
+
+    def shards(self, searchInformation, shardBy=('type',)):
+        if isinstance(shardBy, str):
+            shardBy = (shardBy,)
+        for key in shardBy:
+            if key not in ShardedSearch.SHARD_KEYS:
+                raise ValueError(f'Cannot shard search by {key!r}, expected one of {ShardedSearch.SHARD_KEYS}')
+        info = searchInformation.payload['searchInformation']
+        searchTypes = info.get('searchTypes') or []
+        searchFields = info.get('searchFields') or []
+        types = [[t] for t in (searchTypes or DEFAULT_SEARCH_TYPES)] if 'type' in shardBy else [searchTypes]
+        fields = [[f] for f in searchFields] if 'field' in shardBy and searchFields else [searchFields]
+        sites = self.sites() if 'site' in shardBy and not info.get('siteId') else [info.get('siteId')]
+        shards = []
+        for searchTypes in types:
+            for searchFields in fields:
+                for siteId in sites:
+                    shards.append(SearchInformation(info.get('searchTerms'), searchFields, searchTypes,
+                                                    siteId=siteId, siteName=info.get('siteName')))
+        return shards
+
+    def _run(self, shard):
+        if self.cache is not None:
+            cached = self.cache.get(shard)
+            if cached is not None:
+                return cached
+        matches = self._driver.search(shard).get('matches', [])
+        if self.cache is not None:
+            self.cache.put(shard, matches)
+        return matches
+
+    def stream(self, searchInformation, shardBy=('type',)):
+        """ Yields de-duplicated matches as soon as each shard completes. """
+        seen = set()
+        shards = self.shards(searchInformation, shardBy)
+        self._driver.debug(f'Running search in {len(shards)} shards')
+        run = carryLane(self._driver, self._run)
+        with ThreadPoolExecutor(max_workers=self.maxWorkers) as pool:
+            for future in as_completed([pool.submit(run, shard) for shard in shards]):
+                for match in future.result():
+                    key = (match.get('type'), match.get('id'))
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    yield match
@@ -0,0 +1,167 @@
+""" Content hashes for exported assets and Merkle hashes for folders. A folder's
+hash covers its own content and the hashes of everything below it, so two
+snapshots can be compared top-down and unchanged subtrees skipped whole. """
+
+import gzip
+import hashlib
+import json
+import os
+
+# version of the export layout and of contentHash, recorded in the manifest and index;
+# version 1 hashed the LOCATION fields too and left out the root folder record
+FORMAT = 2
+
+# properties that change without the asset's content changing
+VOLATILE = ('children', 'lastModifiedDate', 'lastModifiedBy', 'lastPublishedDate', 'lastPublishedBy')
+
+
+def iterSnapshot(path):
+    """ Yields every record of an export, whether a single .ndjson.gz file or a shard directory. """
+    if os.path.isdir(path):
+        files = sorted(os.path.join(path, f) for f in os.listdir(path) if f.endswith('.ndjson.gz'))
+    else:
+        files = [path]
+    for name in files:
+        with gzip.open(name, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def snapshotFormat(path):
+    """ FORMAT the export at `path` was written in, read from its manifest; 1 when it has none. """
+    manifest = os.path.join(path, 'manifest.json') if os.path.isdir(path) else f'{path}.manifest.json'
+    if not os.path.exists(manifest):
+        return 1
+    with open(manifest) as f:
+        return json.load(f).get('format', 1)
+
+
+# where the asset lives rather than what it holds; moves are tracked through the parent instead
+LOCATION = ('id', 'path', 'parentFolderId', 'parentFolderPath', 'siteId', 'siteName', 'createdDate', 'createdBy')
+
+
+def contentHash(asset: dict):
+    """ Hash of the asset's content, equal for copies and for the same asset after a move. """
+    stable = {k: v for k, v in asset.items() if k not in VOLATILE and k not in LOCATION}
+    return hashlib.sha256(json.dumps(stable, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+
+class SnapshotIndex:
+    """
+    id -> {'type', 'parent', 'path', 'hash'} for every asset of a snapshot,
+    without the asset bodies. merkle() adds a subtree hash for each folder;
+    assets whose parent is not in the snapshot hang off a virtual root (None).
+    """
+
+    def __init__(self, entries=None):
+        self.entries = entries or {}
+        self._merkle = None
+        self._children = None
+
+    @classmethod
+    def fromSnapshot(cls, path, trustHashes=None):
+        """ Builds the index from the records. Their stored hashes are only used when the
+        snapshot is of the current FORMAT (or trustHashes is True); older ones are rehashed. """
+        if trustHashes is None:
+            trustHashes = snapshotFormat(path) == FORMAT
+        entries = {}
+        for record in iterSnapshot(path):
+            asset = record['asset']
+            stored = record.get('hash') if trustHashes else None
+            entries[record['id']] = {'type': record['type'], 'parent': asset.get('parentFolderId'),
+                                     'path': record.get('path'), 'hash': stored or contentHash(asset)}
+        return cls(entries)
+
+    def children(self):
+        if self._children is None:
+            self._children = {}
+            for assetId, entry in self.entries.items():
+                parent = entry['parent'] if entry['parent'] in self.entries else None
+                self._children.setdefault(parent, []).append(assetId)
+        return self._children
+
+    def merkle(self):
+        """ id -> subtree hash (the content hash for non-folders), plus None for the root. """
+        if self._merkle is not None:
+            return self._merkle
+        children = self.children()
+        hashes = {}
+        # every folder after its parent, reversed below so each child hash is known before its parent's
+        # (walked through the tree, not path depth: a site's root folder has the path '/')
+        folders, stack = [], [None]
+        while stack:
+            for kid in children.get(stack.pop(), ()):
+                if self.entries[kid]['type'] == 'folder':
+                    folders.append(kid)
+                    stack.append(kid)
+        for assetId, entry in self.entries.items():
+            if entry['type'] != 'folder':
+                hashes[assetId] = entry['hash']
+
+        def combine(own, kids):
+            digest = hashlib.sha256(own.encode('utf-8'))
+            for kid in sorted(kids):
+                digest.update(f'{kid}:{hashes[kid]};'.encode('utf-8'))
+            return digest.hexdigest()
+
+        for folderId in reversed(folders):
+            hashes[folderId] = combine(self.entries[folderId]['hash'], children.get(folderId, ()))
+        hashes[None] = combine('', children.get(None, ()))
+        self._merkle = hashes
+        return hashes
+
+    @property
+    def rootHash(self):
+        return self.merkle()[None]
+
+    def changedIds(self, other):
+        """
+        Ids that differ between this snapshot and `other` (added, removed, moved
+        or changed), found by descending only into folders whose Merkle hashes
+        differ. Returns (ids, number of assets skipped in unchanged subtrees).
+        """
+        mine, theirs = self.merkle(), other.merkle()
+        myChildren, theirChildren = self.children(), other.children()
+        changed = set()
+        skipped = 0
+        stack = [None]
+        while stack:
+            node = stack.pop()
+            for kid in set(myChildren.get(node, ())) | set(theirChildren.get(node, ())):
+                if mine.get(kid) is not None and mine.get(kid) == theirs.get(kid) and \
+                        self.entries[kid]['parent'] == other.entries[kid]['parent']:
+                    skipped += self._subtreeSize(kid)
+                    continue
+                changed.add(kid)
+                if kid in myChildren or kid in theirChildren:
+                    stack.append(kid)
+        return changed, skipped
+
+    def _subtreeSize(self, assetId):
+        children = self.children()
+        size, stack = 0, [assetId]
+        while stack:
+            node = stack.pop()
+            size += 1
+            stack.extend(children.get(node, ()))
+        return size
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({'format': FORMAT, 'entries': self.entries, 'merkle': {k: v for k, v in self.merkle().items() if k is not None},
+                       'rootHash': self.rootHash}, f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        if data.get('format', 1) != FORMAT:
+            raise ValueError(f"{path} is a format {data.get('format', 1)} index, expected {FORMAT}; "
+                             f"rebuild it with SnapshotIndex.fromSnapshot")
+        index = cls(data['entries'])
+        merkle = dict(data.get('merkle') or {})
+        if merkle:
+            merkle[None] = data['rootHash']
+            index._merkle = merkle
+        return index
@@ -0,0 +1,194 @@
+""" Local inverted full-text index over crawled content (page xhtml, structured
+data text, text blocks and metadata) for content audits that the server side
+search cannot answer well. Queries run entirely in memory. """
+
+import html
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from .cmstypes import CascadeIdentifier, StructuredData
+from .crawler import FolderCrawler, unwrapAsset
+from .lanes import carryLane
+
+_TAG = re.compile(r'<[^>]+>')
+_WORD = re.compile(r'\w+', re.UNICODE)
+_QUERY = re.compile(r'(-?)(?:(\w+):)?(?:"([^"]*)"|(\S+))')
+
+METADATA_FIELDS = {'title': 'title', 'displayName': 'displayName', 'summary': 'summary', 'teaser': 'teaser',
+                   'keywords': 'keywords', 'metaDescription': 'description', 'author': 'author'}
+
+
+def tokenize(text):
+    return [w.lower() for w in _WORD.findall(html.unescape(_TAG.sub(' ', text or '')))]
+
+
+class TextIndex:
+    """
+    term -> {asset id -> {field -> [positions]}}. Fields are 'name', 'xhtml',
+    'data' (structured data text), 'text' (text blocks), the standard metadata
+    fields ('title', 'summary', 'description', ...) and 'metadata' for dynamic
+    metadata values.
+
+    Query syntax, all parts must match:
+        tuition                 term in any field
+        "financial aid office"  phrase
+        title:tuition           term in one field
+        xhtml:"old name"        phrase in one field
+        -draft                  exclude assets containing the term
+    """
+
+    def __init__(self):
+        self._postings = {}
+        self._docs = {}
+        # 'type:id' of each root given to build() -> ids indexed under it by the last complete crawl
+        self._roots = {}
+
+    @staticmethod
+    def fields(asset: dict):
+        fields = {'name': asset.get('name', '')}
+        if asset.get('xhtml'):
+            fields['xhtml'] = asset['xhtml']
+        if asset.get('text'):
+            fields['text'] = asset['text']
+        if asset.get('structuredData'):
+            fields['data'] = ' '.join(node.text for node in StructuredData(raw=asset['structuredData']).nodes() if node.text)
+        metadata = asset.get('metadata') or {}
+        for key, field in METADATA_FIELDS.items():
+            if metadata.get(key):
+                fields[field] = metadata[key]
+        dynamic = [value.get('value', '') for f in metadata.get('dynamicFields') or [] for value in f.get('fieldValues') or []]
+        if dynamic:
+            fields['metadata'] = ' '.join(v for v in dynamic if v)
+        return fields
+
+    def update(self, asset: dict, assetType: str):
+        """ (Re-)indexes one asset, replacing whatever was indexed for it before. """
+        assetId = asset['id']
+        self.remove(assetId)
+        terms = set()
+        for field, text in TextIndex.fields(asset).items():
+            for position, term in enumerate(tokenize(text)):
+                self._postings.setdefault(term, {}).setdefault(assetId, {}).setdefault(field, []).append(position)
+                terms.add(term)
+        self._docs[assetId] = {'type': assetType, 'path': asset.get('path'), 'siteName': asset.get('siteName'), 'terms': sorted(terms)}
+
+    def remove(self, assetId: str):
+        doc = self._docs.pop(assetId, None)
+        if doc is None:
+            return
+        for term in doc['terms']:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(assetId, None)
+                if not postings:
+                    del self._postings[term]
+
+    def _termMatches(self, term, field):
+        """ {asset id -> count} for a single term. """
+        matches = {}
+        for assetId, fields in self._postings.get(term, {}).items():
+            count = len(fields.get(field, ())) if field else sum(len(p) for p in fields.values())
+            if count:
+                matches[assetId] = count
+        return matches
+
+    def _phraseMatches(self, terms, field):
+        if len(terms) == 1:
+            return self._termMatches(terms[0], field)
+        candidates = None
+        for term in terms:
+            ids = set(self._postings.get(term, {}))
+            candidates = ids if candidates is None else candidates & ids
+            if not candidates:
+                return {}
+        matches = {}
+        for assetId in candidates:
+            first = self._postings[terms[0]][assetId]
+            for name in ([field] if field else first.keys()):
+                for start in first.get(name, ()):
+                    if all(start + offset in self._positions(term, assetId, name) for offset, term in enumerate(terms[1:], 1)):
+                        matches[assetId] = matches.get(assetId, 0) + 1
+        return matches
+
+    def _positions(self, term, assetId, field):
+        return set(self._postings.get(term, {}).get(assetId, {}).get(field, ()))
+
+    def search(self, query: str, limit=None):
+        """ Returns matching assets as CascadeIdentifiers, best matches first. """
+        scores = None
+        excluded = set()
+        for negate, field, phrase, word in _QUERY.findall(query):
+            terms = tokenize(phrase if phrase else word)
+            if not terms:
+                continue
+            matches = self._phraseMatches(terms, field or None)
+            if negate:
+                excluded.update(matches)
+                continue
+            if scores is None:
+                scores = dict(matches)
+            else:
+                scores = {k: scores[k] + v for k, v in matches.items() if k in scores}
+        ranked = sorted((k for k in (scores or {}) if k not in excluded), key=lambda k: (-scores[k], k))
+        if limit is not None:
+            ranked = ranked[:limit]
+        return [CascadeIdentifier(type=self._docs[k]['type'], id=k) for k in ranked]
+
+    def describe(self, assetId: str):
+        doc = self._docs.get(assetId)
+        return {'id': assetId, 'type': doc['type'], 'path': doc['path'], 'siteName': doc['siteName']} if doc else None
+
+    def build(self, driver, root, types=('page', 'block'), maxWorkers=4):
+        """ Crawls `root` (folder or site) and indexes every asset of `types`.
+        Run again over the same root to refresh the index from a re-crawl:
+        assets indexed under it before but no longer found there (deleted or
+        moved out) are removed, unless part of the tree could not be read. """
+        crawler = FolderCrawler(driver, types=types, maxWorkers=maxWorkers)
+        rootKey = f"{root['type']}:{root['id']}" if isinstance(root, dict) else f'{root.type}:{root.id}'
+        seen = set()
+
+        def read(child):
+            return child['type'], unwrapAsset(driver.read(CascadeIdentifier(type=child['type'], id=child['id'])))[1]
+
+        pending = set()
+
+        def collect(futures):
+            for future in futures:
+                assetType, asset = future.result()
+                if asset:
+                    self.update(asset, assetType)
+
+        read = carryLane(driver, read)
+        with ThreadPoolExecutor(max_workers=maxWorkers) as pool:
+            for child in crawler.crawl(root):
+                seen.add(child['id'])
+                # keep only a few asset bodies in memory; map() would queue the whole crawl
+                if len(pending) >= maxWorkers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                pending.add(pool.submit(read, child))
+            collect(wait(pending).done)
+        if crawler.failedFolders:
+            driver.error(f'{crawler.failedFolders} folders under {rootKey} could not be read; '
+                         f'assets missing from this crawl were kept in the text index')
+            self._roots[rootKey] = sorted(seen.union(self._roots.get(rootKey, ())))
+        else:
+            for assetId in set(self._roots.get(rootKey, ())) - seen:
+                self.remove(assetId)
+            self._roots[rootKey] = sorted(seen)
+        driver.info(f'Text index holds {len(self._docs)} assets and {len(self._postings)} terms')
+        return self
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({'docs': self._docs, 'postings': self._postings, 'roots': self._roots}, f)
+
+    @classmethod
+    def load(cls, path):
+        index = cls()
+        with open(path) as f:
+            data = json.load(f)
+        index._docs = data['docs']
+        index._postings = data['postings']
+        index._roots = data.get('roots', {})
+        return index
@@ -0,0 +1,33 @@
+""" Rate limiting helpers shared by the schedulers and executors. """
+
+import threading
+import time
+
+
+class RateLimiter:
+    """
+    Thread-safe token bucket. `rate` tokens are added per second up to `burst`;
+    acquire() blocks until a token is available.
+    """
+
+    def __init__(self, rate=1.0, burst=1):
+        self.rate = float(rate)
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
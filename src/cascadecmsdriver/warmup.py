@@ -0,0 +1,161 @@
+""" Background cache warm-up. Reads a working set (sites, root folders, shared
+blocks, templates and formats, plus recorded hot assets) into the response
+cache at a low request rate, and reads it again before the entries expire so
+interactive reads keep hitting a warm cache. """
+
+import json
+import os
+import threading
+from collections import Counter
+from .cmstypes import CascadeIdentifier
+from .crawler import matchesType, unwrapAsset
+from .lanes import LANE_BACKGROUND
+from .throttle import RateLimiter
+
+
+class CacheWarmer:
+    """
+    Usage:
+        warmer = CacheWarmer(driver, hotIdsPath='hot-ids.json')
+        warmer.recordReads()        # optional: learn which assets are read most
+        warmer.start()              # warms now, then again before entries expire
+        ...
+        warmer.stop()               # also saves the recorded hot ids
+
+    Per site the working set is the site record, its root folder, assets of
+    `types` directly in the root folder, and everything of `types` inside
+    root level folders named in `sharedFolders`. Hot ids are warmed first.
+    Every pass re-reads with driver.refreshingCache(), so each entry's expiry
+    is renewed; passes repeat once `1 - refreshAhead` of the cache TTL has passed.
+    Its requests go through the background lane, behind interactive and bulk work.
+    """
+
+    def __init__(self, driver, types=('block', 'template', 'format'), sharedFolders=('_internal', '_shared', '_cms'),
+                 sites=None, hotIdsPath=None, rate=2.0, refreshAhead=0.2, maxAssetsPerSite=2000):
+        self._driver = driver
+        self.types = tuple(types)
+        self.sharedFolders = tuple(sharedFolders)
+        self.sites = sites
+        self.hotIdsPath = hotIdsPath
+        self.refreshAhead = refreshAhead
+        self.maxAssetsPerSite = maxAssetsPerSite
+        self.limiter = RateLimiter(rate)
+        self.hotIds = []
+        if hotIdsPath and os.path.exists(hotIdsPath):
+            with open(hotIdsPath) as f:
+                self.hotIds = [CascadeIdentifier(type=i['type'], id=i['id']) for i in json.load(f)]
+        self.stats = {'passes': 0, 'reads': 0, 'failed': 0}
+        self._reads = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+        self._local = threading.local()
+
+    def _read(self, identifier):
+        if self._stop.is_set():
+            return None
+        self.limiter.acquire()
+        try:
+            response = self._driver.read(identifier)
+        except Exception as e:
+            self._driver.error(f'Warm-up read of {identifier.type} {identifier.id} failed: {e}')
+            self.stats['failed'] += 1
+            return None
+        self.stats['reads'] += 1
+        return unwrapAsset(response)[1]
+
+    def _warmSite(self, siteId):
+        site = self._read(CascadeIdentifier(type='site', id=siteId))
+        if not site or not site.get('rootFolderId'):
+            return
+        root = self._read(CascadeIdentifier(type='folder', id=site['rootFolderId']))
+        if not root:
+            return
+        budget = self.maxAssetsPerSite
+        folders = []
+        for child in root.get('children', []):
+            name = (child.get('path') or {}).get('path', '').rsplit('/', 1)[-1]
+            if child['type'] == 'folder' and name in self.sharedFolders:
+                folders.append(child['id'])
+            elif self.types and matchesType(child['type'], self.types) and budget > 0:
+                self._read(CascadeIdentifier(type=child['type'], id=child['id']))
+                budget -= 1
+        # walked here rather than with FolderCrawler so every read stays on this
+        # thread, inside refreshingCache() and behind the rate limiter
+        while folders and budget > 0 and not self._stop.is_set():
+            folder = self._read(CascadeIdentifier(type='folder', id=folders.pop(0)))
+            for child in (folder or {}).get('children', []):
+                if child['type'] == 'folder':
+                    folders.append(child['id'])
+                elif matchesType(child['type'], self.types) and budget > 0:
+                    self._read(CascadeIdentifier(type=child['type'], id=child['id']))
+                    budget -= 1
+
+    def warm(self):
+        """ Runs one pass over the working set on the calling thread. """
+        self._local.warming = True
+        try:
+            self._pass()
+        finally:
+            self._local.warming = False
+        self.stats['passes'] += 1
+        self._driver.info(f"Cache warm-up pass {self.stats['passes']} finished: {self.stats}")
+
+    def _pass(self):
+        with self._driver.refreshingCache(), self._driver.lane(LANE_BACKGROUND):
+            for identifier in self.hotIds:
+                self._read(identifier)
+            self.limiter.acquire()
+            sites = [s['id'] for s in self._driver.listSites().get('sites', [])]
+            for siteId in sites:
+                if self.sites and siteId not in self.sites:
+                    continue
+                if self._stop.is_set():
+                    break
+                self._warmSite(siteId)
+
+    def interval(self):
+        cache = self._driver.cache
+        return cache.expireAfter * (1 - self.refreshAhead) if cache is not None else None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.warm()
+            except Exception as e:
+                self._driver.error(f'Cache warm-up pass failed: {e}')
+            interval = self.interval()
+            if interval is None or self._stop.wait(interval):
+                return
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='cache-warmer', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self.hotIdsPath and self._reads:
+            self.saveHotIds(self.hotIdsPath)
+
+    def recordReads(self):
+        """ Counts every driver.read from now on, to pick the hot ids. """
+        read = self._driver.read
+
+        def recording(identifier):
+            if not getattr(self._local, 'warming', False):
+                self._reads[(identifier.type, identifier.id)] += 1
+            return read(identifier)
+
+        self._driver.read = recording
+        return self
+
+    def saveHotIds(self, path, limit=500):
+        """ Saves the most read assets, merged with the ids loaded at start. """
+        counts = Counter({(i.type, i.id): 1 for i in self.hotIds})
+        counts.update(self._reads)
+        with open(path, 'w') as f:
+            json.dump([{'type': t, 'id': i} for (t, i), _ in counts.most_common(limit)], f)
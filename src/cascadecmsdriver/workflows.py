@@ -0,0 +1,189 @@
+""" Workflow settings for a whole folder tree. Reads every folder's settings
+concurrently once, then answers inheritance questions locally and plans the
+smallest set of editWorkflowSettings calls that reaches a target state. """
+
+from concurrent.futures import ThreadPoolExecutor
+from .cmstypes import CascadeIdentifier
+from .crawler import FolderCrawler, unwrapAsset
+from .lanes import carryLane
+
+# settings fields that editWorkflowSettings can push down to every descendant
+APPLY_FLAGS = {'requireWorkflow': 'applyRequireWorkflowToChildren',
+               'inheritWorkflows': 'applyInheritWorkflowsToChildren'}
+
+
+def _definitionIds(definitions):
+    return [d['id'] if isinstance(d, dict) else d for d in definitions or []]
+
+
+class WorkflowResolver:
+    """
+    Usage:
+        workflows = WorkflowResolver(driver).load(CascadeIdentifier('site', siteId))
+        workflows.effective(folderId)                 # {'definitions', 'requireWorkflow', 'inheritWorkflows'}
+        workflows.foldersRequiring(definitionId)      # folders where that workflow is required
+        plan = workflows.planSetting('requireWorkflow', False)
+        workflows.apply(plan)                         # or apply(plan, dryRun=True)
+
+    A folder's effective definitions are its own plus, when inheritWorkflows
+    is set, its parent's effective definitions. planSetting() takes a value
+    or a callable (folderId, settings) -> value and uses the apply-to-children
+    flags wherever one call can fix a whole subtree.
+    """
+
+    def __init__(self, driver, maxWorkers=8):
+        self._driver = driver
+        self.maxWorkers = maxWorkers
+        self.settings = {}
+        self.parents = {}
+        self.children = {}
+        self.paths = {}
+        self.root = None
+        self._effective = {}
+
+    def _readSettings(self, folderId):
+        response = self._driver.readWorkflowSettings(CascadeIdentifier(type='folder', id=folderId))
+        settings = response.get('workflowSettings')
+        if settings is None:
+            self._driver.error(f"Could not read workflow settings of folder {folderId}: {response.get('message')}")
+        return folderId, settings
+
+    def load(self, root):
+        """ Reads the settings of `root` (folder or site) and every folder below it. """
+        if isinstance(root, dict):
+            root = CascadeIdentifier(type=root['type'], id=root['id'])
+        rootId = root.id
+        if root.type == 'site':
+            rootId = (unwrapAsset(self._driver.read(root))[1] or {}).get('rootFolderId')
+        crawler = FolderCrawler(self._driver, types=('folder',), maxWorkers=self.maxWorkers)
+        rootFolder = unwrapAsset(self._driver.read(CascadeIdentifier(type='folder', id=rootId)))[1] or {}
+        self.root = rootId
+        rootPath = rootFolder.get('path') or '/'
+        byPath = {rootPath: rootId, rootPath.strip('/'): rootId}
+        self.paths = {rootId: rootPath}
+        self.parents = {rootId: None}
+        self.children = {rootId: []}
+        # crawl yields each level after its parents, so every parent path is already known
+        for record in crawler.crawl(CascadeIdentifier(type='folder', id=rootId)):
+            path = (record.get('path') or {}).get('path', '')
+            parentId = byPath.get(path.rsplit('/', 1)[0] if '/' in path else '', rootId)
+            byPath[path] = record['id']
+            self.paths[record['id']] = path
+            self.parents[record['id']] = parentId
+            self.children.setdefault(parentId, []).append(record['id'])
+            self.children.setdefault(record['id'], [])
+        with ThreadPoolExecutor(max_workers=self.maxWorkers) as pool:
+            for folderId, settings in pool.map(carryLane(self._driver, self._readSettings), list(self.parents)):
+                if settings is not None:
+                    self.settings[folderId] = settings
+        self._effective = {}
+        self._driver.info(f'Loaded workflow settings for {len(self.settings)} of {len(self.parents)} folders')
+        return self
+
+    def _topDown(self):
+        order, stack = [], [self.root]
+        while stack:
+            folderId = stack.pop()
+            order.append(folderId)
+            stack.extend(reversed(self.children.get(folderId, [])))
+        return order
+
+    def effective(self, folderId):
+        if not self._effective:
+            for current in self._topDown():
+                settings = self.settings.get(current) or {}
+                parent = self.parents.get(current)
+                if parent is None:
+                    inherited = _definitionIds(settings.get('inheritedWorkflowDefinitions'))
+                else:
+                    inherited = self._effective[parent]['definitions']
+                definitions = list(dict.fromkeys(_definitionIds(settings.get('workflowDefinitions')) +
+                                                 (inherited if settings.get('inheritWorkflows') else [])))
+                self._effective[current] = {'definitions': definitions,
+                                            'requireWorkflow': bool(settings.get('requireWorkflow')),
+                                            'inheritWorkflows': bool(settings.get('inheritWorkflows'))}
+        return self._effective.get(folderId)
+
+    def foldersWith(self, definitionId):
+        """ Folders where the workflow definition is available, directly or inherited. """
+        return [f for f in self._topDown() if definitionId in self.effective(f)['definitions']]
+
+    def foldersRequiring(self, definitionId=None):
+        """ Folders that require workflow, optionally only those offering `definitionId`. """
+        return [f for f in self._topDown() if self.effective(f)['requireWorkflow'] and
+                (definitionId is None or definitionId in self.effective(f)['definitions'])]
+
+    def planSetting(self, field, target):
+        """
+        Fewest edits that leave `field` ('requireWorkflow' or 'inheritWorkflows')
+        at the target value on every folder. An edit either sets one folder or,
+        with the apply-to-children flag, its whole subtree; the plan is found
+        with a dynamic program over the tree. Returns steps in top-down order.
+        """
+        if field not in APPLY_FLAGS:
+            raise ValueError(f'Cannot plan {field!r}, expected one of {tuple(APPLY_FLAGS)}')
+        wanted = {f: bool(target(f, self.settings.get(f) or {}) if callable(target) else target) for f in self.parents}
+        current = {f: bool((self.settings.get(f) or {}).get(field)) for f in self.parents}
+        order = self._topDown()
+        states = (None, True, False)
+        # cost[f][state]: edits needed under f when the nearest pushed-down value above it is `state`
+        cost = {}
+        for folderId in reversed(order):
+            kids = self.children.get(folderId, [])
+            cost[folderId] = {}
+            for state in states:
+                value = current[folderId] if state is None else state
+                keep = (value != wanted[folderId]) + sum(cost[k][state][0] for k in kids)
+                push = 1 + sum(cost[k][wanted[folderId]][0] for k in kids)
+                cost[folderId][state] = (push, 'push') if push < keep else (keep, 'set' if value != wanted[folderId] else None)
+        plan = []
+        stack = [(self.root, None)]
+        while stack:
+            folderId, state = stack.pop()
+            _, action = cost[folderId][state]
+            if action is not None:
+                plan.append({'id': folderId, 'path': self.paths.get(folderId), 'field': field,
+                             'value': wanted[folderId], 'applyToChildren': action == 'push'})
+            childState = wanted[folderId] if action == 'push' else state
+            stack.extend((k, childState) for k in reversed(self.children.get(folderId, [])))
+        return plan
+
+    def apply(self, *plans, dryRun=False):
+        """ Runs one editWorkflowSettings call per folder across all plans, parents first. """
+        steps = {}
+        for plan in plans:
+            for step in plan:
+                steps.setdefault(step['id'], []).append(step)
+        depth = {f: i for i, f in enumerate(self._topDown())}
+        results = []
+        for folderId in sorted(steps, key=depth.get):
+            settings = {k: v for k, v in (self.settings.get(folderId) or {}).items() if k != 'inheritedWorkflowDefinitions'}
+            payload = {'workflowSettings': settings}
+            for step in steps[folderId]:
+                settings[step['field']] = step['value']
+                payload[APPLY_FLAGS[step['field']]] = step['applyToChildren']
+            if dryRun:
+                results.append({'id': folderId, 'path': self.paths.get(folderId), 'payload': payload})
+                continue
+            response = self._driver.edit_asset_workflow_settings('folder', folderId, payload)
+            results.append({'id': folderId, 'path': self.paths.get(folderId), 'response': response})
+            if response and response.get('success') in (True, 'true'):
+                self._record(steps[folderId])
+            else:
+                self._driver.error(f"Editing workflow settings of {self.paths.get(folderId)} failed: {(response or {}).get('message')}")
+        return results
+
+    def _record(self, steps):
+        """ Mirrors a successful edit in the local settings so later queries stay correct. """
+        for step in steps:
+            targets = [step['id']]
+            if step['applyToChildren']:
+                targets = []
+                stack = [step['id']]
+                while stack:
+                    folderId = stack.pop()
+                    targets.append(folderId)
+                    stack.extend(self.children.get(folderId, []))
+            for folderId in targets:
+                self.settings.setdefault(folderId, {})[step['field']] = step['value']
+        self._effective = {}
@@ -1,5 +1,8 @@
+import fnmatch
 from .driver import CascadeCMSRestDriver
 from .cmstypes import CascadeWSDL, CascadeIdentifier, SearchInformation
+from .bulk import BulkEditor
+from .searching import SearchCache, ShardedSearch
 
 
 class CascadeWrapper:
@@ -8,6 +11,7 @@ class CascadeWrapper:
         driver = CascadeCMSRestDriver(api_key=environmentVariable["api_key"], verbose=False)#set to true
         driver.base_url = environmentVariable["cascade_url"]
         self._driver = driver    
+        self._search = ShardedSearch(driver, cache=SearchCache().attach(driver))
     
     def jsonToIdentifier(self, jsonList):
         return [CascadeIdentifier(type=json['type'], id=json['id']) for json in jsonList if(CascadeIdentifier.isIdentifer(json))]
@@ -19,24 +23,58 @@ class CascadeWrapper:
         listSites = self._driver.listSites()
         return self.jsonToIdentifier(listSites["sites"])
     
-    def parseSearch(self, searchTerm="", searchFields=[], searchTypes=[], includeFileExtensions=()):
-        
-        payload = SearchInformation(searchTerm, searchFields, searchTypes)
+    @staticmethod
+    def filterMatches(matches, includeFileExtensions=(), includePaths=(), excludePaths=(), pathPattern=None, limit=None):
+        # filters raw search matches on their path before anything is read. Ex. If I only want image file types then the results should only be .png, .jpg
+        includeFileExtensions = tuple(e.lower() for e in includeFileExtensions)
+        includePaths = tuple(includePaths)
+        excludePaths = tuple(excludePaths)
+        filtered = []
+        for match in matches:
+            if not CascadeIdentifier.isIdentifer(match):
+                continue
+            path = match['path'].get('path', '')
+            if len(includeFileExtensions) > 0 and not path.lower().endswith(includeFileExtensions):
+                continue
+            if len(includePaths) > 0 and not path.startswith(includePaths):
+                continue
+            if len(excludePaths) > 0 and path.startswith(excludePaths):
+                continue
+            if pathPattern is not None and not fnmatch.fnmatchcase(path, pathPattern):
+                continue
+            filtered.append(match)
+            if limit is not None and len(filtered) >= limit:
+                break
+        return filtered
 
-        matches = self._driver.search(payload)["matches"]
-        matches = self.jsonToIdentifier(matches)
-        matches = self.identifierToWSDL(matches)
+    def streamSearch(self, searchTerm="", searchFields=[], searchTypes=[], shardBy=('type',), siteId=None):
+        # yields raw matches as each shard (by 'type', 'site' and/or 'field') returns, cached until the next write
+        payload = SearchInformation(searchTerm, searchFields, searchTypes, siteId=siteId)
+        return self._search.stream(payload, shardBy)
+
+    def parseSearch(self, searchTerm="", searchFields=[], searchTypes=[], includeFileExtensions=(), includePaths=(), excludePaths=(), pathPattern=None, limit=None, hydrate=True, shardBy=()):
 
-        if(len(includeFileExtensions) == 0):
-            return matches
-        # filters results based on the path of the file. Ex. If I only want image file types then the results should only be .png, .jpg
-        filtered = [match for match in matches if match['name'].endswith(includeFileExtensions)]
-        return filtered 
+        matches = self.streamSearch(searchTerm, searchFields, searchTypes, shardBy=shardBy)
+        matches = self.filterMatches(matches, includeFileExtensions, includePaths, excludePaths, pathPattern, limit)
+
+        if not hydrate:
+            # lightweight records: id, type, path and recycled straight from the search response
+            return [CascadeWSDL(match) for match in matches]
+        matches = self.jsonToIdentifier(matches)
+        return self.identifierToWSDL(matches)
 
     def edit(self, asset):
         status = self._driver.edit(asset)
         return status
 
+    def bulkEdit(self, selector, transform, journalPath, maxWorkers=4, retryFailed=True):
+        # selector: SearchInformation, folder/site CascadeIdentifier to crawl, or list of identifiers
+        editor = BulkEditor(self._driver, journalPath, maxWorkers=maxWorkers)
+        try:
+            return editor.run(selector, transform, retryFailed=retryFailed)
+        finally:
+            editor.close()
+
     def readAndParse(self, objectType, id):
         response = self._driver.read_asset(objectType, id)
         if (response['asset'] is not None):
@@ -1,4 +1,7 @@
 from .asyncDriver import CascadeCMSRestDriverAsync
 from .asyncWrapper import CascadeWrapperAsync
+from .concurrency import AdaptiveLimit
+from .resilience import CircuitBreaker, CircuitOpenError, HedgePolicy
 
-__all__ = ["CascadeCMSRestDriverAsync", "CascadeWrapperAsync"]
\ No newline at end of file
+__all__ = ["CascadeCMSRestDriverAsync", "CascadeWrapperAsync", "AdaptiveLimit",
+           "CircuitBreaker", "CircuitOpenError", "HedgePolicy"]
\ No newline at end of file
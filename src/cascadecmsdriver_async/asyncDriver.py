@@ -1,10 +1,23 @@
+import json
 import logging
 import aiohttp
 import asyncio
+from cascadecmsdriver.cache import DEFAULT_CACHE_PATH, ResponseCache, cacheKey
+from .concurrency import OVERLOAD_STATUSES, AdaptiveLimit
+from .resilience import CircuitBreaker, CircuitOpenError, EndpointPolicies, HedgePolicy
+
+# POST endpoints that do not change content, as CascadeCMSRestDriver.READ_ONLY_POSTS
+READ_ONLY_POSTS = ('search', 'readAudits')
+
+
+def _json(value):
+    """ Payload parts may be cmstypes objects or plain dicts. """
+    return json.loads(value.toJson()) if hasattr(value, 'toJson') else value
 
 class CascadeCMSURLBuilder:
     """
-    Builds and collects (method, URL) tuples for Cascade CMS 8 REST API.
+    Builds and collects (method, URL) tuples for Cascade CMS 8 REST API, with the
+    JSON body as a third item for writes that carry one.
     Does not perform HTTP requests—only constructs and collects request data.
     """
 
@@ -28,7 +41,7 @@ class CascadeCMSURLBuilder:
     def edit_asset_workflow_settings(self, asset_type='page', asset_identifier=None, payload=None):
         url = self._build_url('editWorkflowSettings',
                               asset_type, asset_identifier)
-        self.reqUrls.append(('POST', url))
+        self.reqUrls.append(('POST', url, json.dumps(payload) if payload else None))
 
     def workflows_exist(self, workflow_settings):
         ws = workflow_settings.get('workflowSettings', workflow_settings)
@@ -43,18 +56,20 @@ class CascadeCMSURLBuilder:
 
     def publish_asset(self, asset_type='page', asset_identifier='', publish_information=None):
         url = self._build_url('publish', asset_type, asset_identifier)
-        self.reqUrls.append(('POST', url))
+        self.reqUrls.append(('POST', url, json.dumps(publish_information) if publish_information else None))
 
     def unpublish_asset(self, asset_type='page', asset_identifier=''):
-        self.publish_asset(asset_type, asset_identifier)
+        self.publish_asset(asset_type, asset_identifier, {'unpublish': True})
 
     def copy_asset_to_new_container(self, asset_type='page', asset_identifier='', new_name='', destination_container_identifier=''):
         url = self._build_url('copy', asset_type, asset_identifier)
-        self.reqUrls.append(('POST', url))
+        payload = {'copyParameters': {'destinationContainerIdentifier': {'type': 'folder', 'id': destination_container_identifier},
+                                      'doWorkflow': False, 'newName': new_name}}
+        self.reqUrls.append(('POST', url, json.dumps(payload)))
 
     def batch(self, operations):
         url = self._build_url('batch')
-        self.reqUrls.append(('POST', url))
+        self.reqUrls.append(('POST', url, json.dumps({'operations': [_json(op) for op in operations]})))
 
     def checkIn(self, identifier, comments):
         url = self._build_url(
@@ -69,16 +84,23 @@ class CascadeCMSURLBuilder:
     def copy(self, identifier, copyParameters, workflowConfiguration):
         url = self._build_url(
             'copy', identifier.asset_type, identifier.asset_id)
-        self.reqUrls.append(('POST', url))
+        payload = {'copyParameters': _json(copyParameters)}
+        if workflowConfiguration:
+            payload['workflowConfiguration'] = _json(workflowConfiguration)
+        self.reqUrls.append(('POST', url, json.dumps(payload)))
 
     def create(self, asset):
         url = self._build_url('create')
-        self.reqUrls.append(('POST', url))
+        body = _json(asset)
+        self.reqUrls.append(('POST', url, json.dumps({'asset': body.get('asset', body)})))
 
     def delete(self, identifier, deleteParameters, workflowConfiguration=None):
         url = self._build_url(
             'delete', identifier.asset_type, identifier.asset_id)
-        self.reqUrls.append(('POST', url))
+        payload = {'deleteParameters': _json(deleteParameters)}
+        if workflowConfiguration:
+            payload['workflowConfiguration'] = _json(workflowConfiguration)
+        self.reqUrls.append(('POST', url, json.dumps(payload)))
 
     def deleteMessage(self, identifier):
         url = self._build_url(
@@ -87,12 +109,13 @@ class CascadeCMSURLBuilder:
 
     def edit(self, asset):
         url = self._build_url('edit')
-        self.reqUrls.append(('POST', url))
+        self.reqUrls.append(('POST', url, json.dumps(_json(asset))))
 
     def editAccessRights(self, accessRightsInformation, applyToChildren=False):
         id = accessRightsInformation.identifier
         url = self._build_url('editAccessRights', id.asset_type, id.asset_id)
-        self.reqUrls.append(('POST', url))
+        payload = {'accessRightsInformation': _json(accessRightsInformation), 'applyToChildren': applyToChildren}
+        self.reqUrls.append(('POST', url, json.dumps(payload)))
 
     def editPreference(self, preference):
         url = self._build_url('editPreference')
@@ -102,7 +125,10 @@ class CascadeCMSURLBuilder:
         ident = workflowSettings.identifier
         url = self._build_url('editWorkflowSettings',
                               ident.asset_type, ident.asset_id)
-        self.reqUrls.append(('POST', url))
+        payload = {'workflowSettings': _json(workflowSettings),
+                   'applyInheritWorkflowsToChildren': applyInheritWorkflowsToChildren,
+                   'applyRequireWorkflowToChildren': applyRequireWorkflowToChildren}
+        self.reqUrls.append(('POST', url, json.dumps(payload)))
 
     def listEditorConfigurations(self, identifier):
         url = self._build_url('listEditorConfigurations',
@@ -130,7 +156,10 @@ class CascadeCMSURLBuilder:
     def move(self, identifier, moveParameters, workflowConfiguration=None):
         url = self._build_url(
             'move', identifier.asset_type, identifier.asset_id)
-        self.reqUrls.append(('POST', url))
+        payload = {'moveParameters': _json(moveParameters)}
+        if workflowConfiguration:
+            payload['workflowConfiguration'] = _json(workflowConfiguration)
+        self.reqUrls.append(('POST', url, json.dumps(payload)))
 
     def performWorkflowTransition(self, workflowTransitionInformation):
         url = self._build_url('performWorkflowTransition')
@@ -139,7 +168,7 @@ class CascadeCMSURLBuilder:
     def publish(self, publishInformation):
         id = publishInformation.identifier
         url = self._build_url('publish', id.asset_type, id.asset_id)
-        self.reqUrls.append(('POST', url))
+        self.reqUrls.append(('POST', url, json.dumps({'publishInformation': _json(publishInformation)})))
 
     def read(self, identifier):
         url = self._build_url(
@@ -190,10 +219,18 @@ class CascadeCMSRestDriverAsync(CascadeCMSURLBuilder):
     Inherits URL-building from CascadeCMSURLBuilder and applies an optional parser function to each response.
     """
 
-    def __init__(self, cascadeUrl, apiKey, verbose=False, parser_fn=None):
+    def __init__(self, cascadeUrl, apiKey, verbose=False, parser_fn=None, cache=True, concurrency=True,
+                 hedge=None, breaker=None):
         super().__init__(cascadeUrl)
         self._apiKey = apiKey
         self._parser_fn = parser_fn or (lambda x: x)
+        # same file, keys and expiry as CascadeCMSRestDriver, so either driver can warm it for the other
+        self.cache = ResponseCache(DEFAULT_CACHE_PATH) if cache is True else (cache or None)
+        # in-flight request limit adjusted from latency and 429/5xx responses; an AdaptiveLimit, True, or False for none
+        self.concurrency = AdaptiveLimit() if concurrency is True else (concurrency or None)
+        # opt-in, per endpoint: True for defaults everywhere or {endpoint: options, '*': default options}
+        self.hedges = EndpointPolicies(HedgePolicy, hedge) if hedge else None
+        self.breakers = EndpointPolicies(CircuitBreaker, breaker) if breaker else None
         self.setup_logging(verbose)
         self.info("Initializing URL builder")
 
@@ -205,17 +242,119 @@ class CascadeCMSRestDriverAsync(CascadeCMSURLBuilder):
         self.isFlushed = True
         self.info("Flushing request queue")
 
-    async def fetchData(self, session, method, url):
+    async def fetchData(self, session, method, url, data=None):
         raw = None
-        async with session.request(method, url) as response:
-            raw = await response.json()
+        key = cacheKey(method, url)
+        if self.cache is not None and method == 'GET':
+            raw = await asyncio.to_thread(self.cache.get, key)
+        if raw is None:
+            raw = await self._guarded(session, method, url, data)
+            if self.cache is not None:
+                if method != 'GET':
+                    if url.split('/api/v1/', 1)[-1].split('/', 1)[0] not in READ_ONLY_POSTS:
+                        # edits and creates name their asset only in the body
+                        await asyncio.to_thread(self.cache.onWrite, url, data)
+                elif raw.get('success') not in (False, 'false'):
+                    await asyncio.to_thread(self.cache.put, key, url, raw)
         # apply parsing callback to raw JSON
         return self._parser_fn(raw)
 
+    async def _guarded(self, session, method, url, data=None):
+        """ One logical request: checked against the endpoint's circuit breaker and,
+        for GETs, hedged when the endpoint has a HedgePolicy. """
+        endpoint = url.split('/api/v1/', 1)[-1].split('/', 1)[0]
+        breaker = self.breakers.get(endpoint) if self.breakers is not None else None
+        hedge = self.hedges.get(endpoint) if self.hedges is not None and method == 'GET' else None
+        sent = asyncio.Event()
+        # breaker generation the request was let through in
+        generation = [None]
+
+        def onSend():
+            # checked as the request leaves the queue, so queued requests see a circuit that opened meanwhile
+            if breaker is not None and not sent.is_set():
+                generation[0] = breaker.allow(endpoint)
+            sent.set()
+
+        try:
+            if hedge is not None:
+                status, raw = await self._hedged(session, method, url, hedge, sent, onSend)
+            else:
+                status, raw = await self._request(session, method, url, onSend, data)
+        except asyncio.CancelledError:
+            if breaker is not None and sent.is_set():
+                breaker.abandon(generation[0])
+            raise
+        except Exception:
+            # a CircuitOpenError comes before anything is sent and is not an outcome
+            if breaker is not None and sent.is_set():
+                breaker.record(False, generation[0])
+            raise
+        if breaker is not None:
+            breaker.record(status not in OVERLOAD_STATUSES and status < 500, generation[0])
+        return raw
+
+    async def _hedged(self, session, method, url, hedge, sent, onSend):
+        hedge.requests += 1
+        loop = asyncio.get_running_loop()
+        attempts = [asyncio.ensure_future(self._request(session, method, url, onSend))]
+        waiter = asyncio.ensure_future(sent.wait())
+        try:
+            # the delay counts from when the request went out, not from when it was queued
+            await asyncio.wait([attempts[0], waiter], return_when=asyncio.FIRST_COMPLETED)
+            sentAt = loop.time()
+            delay = hedge.delay()
+            if delay is not None and not attempts[0].done():
+                done, _ = await asyncio.wait(attempts, timeout=delay)
+                if not done and hedge.spend():
+                    attempts.append(asyncio.ensure_future(self._request(session, method, url, onSend)))
+            pending, error = set(attempts), None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for attempt in done:
+                    if attempt.exception() is None:
+                        hedge.record(loop.time() - sentAt)
+                        hedge.hedgeWins += attempt is not attempts[0]
+                        return attempt.result()
+                    error = attempt.exception()
+            raise error
+        finally:
+            waiter.cancel()
+            for attempt in attempts:
+                attempt.cancel()
+
+    async def _request(self, session, method, url, onSend=None, data=None):
+        """ (status, decoded body) of one HTTP call, sent within the concurrency limit.
+        onSend is called right before sending and may raise CircuitOpenError. """
+        if self.concurrency is None:
+            if onSend is not None:
+                onSend()
+            async with session.request(method, url, data=data) as response:
+                return response.status, await response.json()
+        async with self.concurrency.slot(url.split('/api/v1/', 1)[-1].split('/', 1)[0]) as request:
+            if onSend is not None:
+                try:
+                    onSend()
+                except CircuitOpenError:
+                    # nothing was sent, so there is nothing for the limit to learn
+                    request.counted = False
+                    raise
+            async with session.request(method, url, data=data) as response:
+                request.status = response.status
+                return response.status, await response.json()
+
+    def concurrencyMetrics(self):
+        """ Current in-flight limit, latency, error counts and the history of limit changes. """
+        return self.concurrency.metrics() if self.concurrency is not None else {}
+
+    def resilienceMetrics(self):
+        """ Hedge counts and circuit breaker states per endpoint. """
+        return {'hedges': self.hedges.metrics() if self.hedges is not None else {},
+                'breakers': self.breakers.metrics() if self.breakers is not None else {}}
+
     async def watcher(self):
         headers = {"Authorization": f"bearer {self._apiKey}", "Content-Type": "application/json"}
         async with aiohttp.ClientSession(headers=headers) as session:
-            tasks = [self.fetchData(session, method, url) for method, url in self.reqUrls]
+            tasks = [self.fetchData(session, *request) for request in self.reqUrls]
             return await asyncio.gather(*tasks)
 
     def _submitRequests(self):
@@ -0,0 +1,150 @@
+""" Adaptive in-flight limit for CascadeCMSRestDriverAsync. The limit grows by
+one per round of successful requests while it is the bottleneck, and is cut
+multiplicatively on 429/5xx responses, request errors, or when latency rises
+well above the recent baseline (AIMD). """
+
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+# statuses that mean the server wants less traffic
+OVERLOAD_STATUSES = (429, 502, 503, 504)
+
+
+class AdaptiveLimit:
+    """
+    Usage:
+        limit = AdaptiveLimit(minLimit=2, maxLimit=64)
+        async with limit.slot('read') as request:
+            async with session.get(url) as response:
+                request.status = response.status
+        limit.metrics()     # current limit, latency, error counts and the limit history
+
+    Errors (OVERLOAD_STATUSES, any other 5xx, or an exception in the block)
+    multiply the limit by `backoff`. Latency above `latencyTolerance` times the
+    baseline multiplies it by `latencyBackoff`. Latency and baseline (the
+    fastest of the last `baselineSamples` requests) are kept per endpoint, so
+    a few slow searches or publishes among fast reads are not taken for a
+    slowdown. Only requests started after the last decrease can
+    cause another one, so one burst of failures only counts once. The state
+    persists across event loops, so the limit learned in one batch carries
+    over to the next.
+    """
+    # limit changes kept for metrics()
+    HISTORY = 500
+
+    def __init__(self, minLimit=2, maxLimit=64, initial=None, backoff=0.5, latencyBackoff=0.9,
+                 latencyTolerance=2.0, baselineSamples=200):
+        if not 1 <= minLimit <= maxLimit:
+            raise ValueError(f'Expected 1 <= minLimit <= maxLimit, got {minLimit} and {maxLimit}')
+        self.minLimit = minLimit
+        self.maxLimit = maxLimit
+        self.limit = float(min(maxLimit, max(minLimit, initial if initial is not None else minLimit * 4)))
+        self.backoff = backoff
+        self.latencyBackoff = latencyBackoff
+        self.latencyTolerance = latencyTolerance
+        self.baselineSamples = baselineSamples
+        self.inFlight = 0
+        # endpoint -> moving average of its latency
+        self.latency = {}
+        self.requests = 0
+        self.errors = 0
+        self.overloads = 0
+        self.history = deque([(time.time(), int(self.limit), 'start')], maxlen=AdaptiveLimit.HISTORY)
+        self._samples = {}
+        self._lastDecrease = 0.0
+        self._waiters = deque()
+
+    def _wake(self):
+        loop = asyncio.get_running_loop()
+        while self._waiters and self.inFlight < int(self.limit):
+            waiter = self._waiters.popleft()
+            # waiters left behind by an earlier, finished event loop are dropped
+            if not waiter.done() and waiter.get_loop() is loop:
+                self.inFlight += 1
+                waiter.set_result(None)
+
+    async def _acquire(self):
+        if self.inFlight < int(self.limit) and not self._waiters:
+            self.inFlight += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # the slot was handed over just before the cancel
+                self.inFlight -= 1
+                self._wake()
+            raise
+
+    @asynccontextmanager
+    async def slot(self, endpoint=''):
+        await self._acquire()
+        request = _Request()
+        saturated = self.inFlight >= int(self.limit)
+        start = time.monotonic()
+        try:
+            yield request
+        except asyncio.CancelledError:
+            # e.g. the losing copy of a hedged read; says nothing about the server
+            request.counted = False
+            raise
+        except Exception:
+            request.failed = True
+            raise
+        finally:
+            self.inFlight -= 1
+            if request.counted:
+                self._record(endpoint, start, request, saturated)
+            self._wake()
+
+    def _record(self, endpoint, start, request, saturated):
+        self.requests += 1
+        elapsed = time.monotonic() - start
+        status = request.status or 0
+        if request.failed or status in OVERLOAD_STATUSES or status >= 500:
+            self.errors += 1
+            self.overloads += status in OVERLOAD_STATUSES
+            self._decrease(start, self.backoff, f'status {status}' if status else 'error')
+            return
+        samples = self._samples.setdefault(endpoint, deque(maxlen=self.baselineSamples))
+        samples.append(elapsed)
+        latency = self.latency[endpoint] = 0.9 * self.latency.get(endpoint, elapsed) + 0.1 * elapsed
+        if latency > min(samples) * self.latencyTolerance and len(samples) >= 10:
+            self._decrease(start, self.latencyBackoff, 'latency')
+        elif saturated and self.limit < self.maxLimit:
+            # +1 once a full limit's worth of requests has succeeded
+            before = int(self.limit)
+            self.limit = min(float(self.maxLimit), self.limit + 1.0 / self.limit)
+            if int(self.limit) != before:
+                self.history.append((time.time(), int(self.limit), 'increase'))
+
+    def _decrease(self, start, factor, reason):
+        if start < self._lastDecrease:
+            # sent under the old limit; the decrease already accounted for it
+            return
+        before = int(self.limit)
+        self.limit = max(float(self.minLimit), self.limit * factor)
+        self._lastDecrease = time.monotonic()
+        if int(self.limit) != before:
+            self.history.append((time.time(), int(self.limit), reason))
+
+    def metrics(self):
+        baseline = {endpoint: min(samples) for endpoint, samples in self._samples.items()}
+        return {'limit': int(self.limit), 'minLimit': self.minLimit, 'maxLimit': self.maxLimit,
+                'inFlight': self.inFlight, 'waiting': len(self._waiters), 'latency': dict(self.latency),
+                'baselineLatency': baseline, 'requests': self.requests, 'errors': self.errors,
+                'overloads': self.overloads, 'history': list(self.history)}
+
+
+class _Request:
+    """ Filled in by the caller inside AdaptiveLimit.slot(). """
+
+    def __init__(self):
+        self.status = None
+        self.failed = False
+        # False for requests that were cancelled or never sent
+        self.counted = True
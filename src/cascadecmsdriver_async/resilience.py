@@ -0,0 +1,187 @@
+""" Tail latency and failure handling for CascadeCMSRestDriverAsync, configured
+per endpoint (the path segment after /api/v1/, e.g. 'read' or 'search').
+HedgePolicy sends a second copy of a slow read after the endpoint's p95
+latency and takes whichever answer arrives first; CircuitBreaker stops sending
+requests to an endpoint whose error rate crosses a threshold and lets a probe
+through now and then to detect recovery. """
+
+import time
+from collections import deque
+
+
+class CircuitOpenError(Exception):
+    """ Raised instead of sending a request while the endpoint's circuit is open. """
+
+    def __init__(self, endpoint, retryAfter):
+        super().__init__(f'Circuit for {endpoint!r} is open, retry in {retryAfter:.1f}s')
+        self.endpoint = endpoint
+        self.retryAfter = retryAfter
+
+
+class HedgePolicy:
+    """
+    A read still running after `delay()` seconds gets one duplicate. The delay
+    is the `quantile` of recent successful latencies (never below minDelay),
+    and no hedging happens until `minSamples` latencies are known. At most
+    `budget` of all requests may be hedged, so hedges cannot double the load
+    when the whole server is slow rather than a few requests.
+    """
+
+    def __init__(self, quantile=0.95, minDelay=0.05, budget=0.05, minSamples=20, samples=500):
+        self.quantile = quantile
+        self.minDelay = minDelay
+        self.budget = budget
+        self.minSamples = minSamples
+        self.requests = 0
+        self.hedges = 0
+        self.hedgeWins = 0
+        self._latencies = deque(maxlen=samples)
+
+    def delay(self):
+        """ Seconds to wait before hedging, or None when there is not enough data yet. """
+        if len(self._latencies) < self.minSamples:
+            return None
+        ordered = sorted(self._latencies)
+        return max(self.minDelay, ordered[min(len(ordered) - 1, int(len(ordered) * self.quantile))])
+
+    def spend(self):
+        """ Takes one hedge from the budget; False when it is used up. """
+        if self.hedges + 1 > self.budget * self.requests:
+            return False
+        self.hedges += 1
+        return True
+
+    def record(self, latency):
+        self._latencies.append(latency)
+
+    def metrics(self):
+        return {'requests': self.requests, 'hedges': self.hedges, 'hedgeWins': self.hedgeWins,
+                'hedgeRatio': self.hedges / self.requests if self.requests else 0.0, 'delay': self.delay()}
+
+
+class CircuitBreaker:
+    """
+    Closed: requests flow and outcomes are kept for `window` seconds. Once at
+    least `minRequests` outcomes are known and the failure share reaches
+    `errorRate`, the circuit opens and allow() raises CircuitOpenError for
+    `openFor` seconds. After that it is half open: `probes` requests are let
+    through, and their success closes the circuit again while a failure
+    reopens it, each time for twice as long up to `maxOpenFor`.
+
+    Every state change starts a new generation. allow() returns the
+    generation a request was let through in, and record() and abandon()
+    ignore outcomes from an earlier one. A slow request sent while the
+    circuit was closed therefore cannot close or reopen it in place of the
+    probe.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+    def __init__(self, errorRate=0.5, minRequests=20, window=30.0, openFor=10.0, maxOpenFor=120.0, probes=1):
+        self.errorRate = errorRate
+        self.minRequests = minRequests
+        self.window = window
+        self.baseOpenFor = openFor
+        self.openFor = openFor
+        self.maxOpenFor = maxOpenFor
+        self.probes = probes
+        self.state = CircuitBreaker.CLOSED
+        self.rejected = 0
+        self.opened = 0
+        self._outcomes = deque()
+        self._openedAt = 0.0
+        self._probing = 0
+        self.generation = 0
+
+    def _trim(self, now):
+        while self._outcomes and self._outcomes[0][0] < now - self.window:
+            self._outcomes.popleft()
+
+    def allow(self, endpoint=''):
+        """ Returns the generation to pass to record() once the request may be sent,
+        raises CircuitOpenError otherwise. """
+        now = time.monotonic()
+        if self.state == CircuitBreaker.OPEN:
+            if now - self._openedAt < self.openFor:
+                self.rejected += 1
+                raise CircuitOpenError(endpoint, self.openFor - (now - self._openedAt))
+            self._enter(CircuitBreaker.HALF_OPEN)
+            self._probing = 0
+        if self.state == CircuitBreaker.HALF_OPEN:
+            if self._probing >= self.probes:
+                self.rejected += 1
+                raise CircuitOpenError(endpoint, 0.0)
+            self._probing += 1
+        return self.generation
+
+    def abandon(self, generation=None):
+        """ For an allowed request that was cancelled before it had an outcome. """
+        if generation not in (None, self.generation):
+            return
+        if self.state == CircuitBreaker.HALF_OPEN and self._probing > 0:
+            self._probing -= 1
+
+    def record(self, success, generation=None):
+        """ Counts the outcome of a request let through in `generation` (the current one when None). """
+        if generation not in (None, self.generation):
+            # sent before the last state change, e.g. while closed and answered after opening
+            return
+        now = time.monotonic()
+        if self.state == CircuitBreaker.HALF_OPEN:
+            if success:
+                self._enter(CircuitBreaker.CLOSED)
+                self.openFor = self.baseOpenFor
+                self._outcomes.clear()
+            else:
+                self._open(now, min(self.maxOpenFor, self.openFor * 2))
+            return
+        if self.state == CircuitBreaker.OPEN:
+            return
+        self._outcomes.append((now, success))
+        self._trim(now)
+        failures = sum(1 for _, ok in self._outcomes if not ok)
+        if len(self._outcomes) >= self.minRequests and failures >= self.errorRate * len(self._outcomes):
+            self._open(now, self.openFor)
+
+    def _enter(self, state):
+        self.state = state
+        self.generation += 1
+
+    def _open(self, now, openFor):
+        self._enter(CircuitBreaker.OPEN)
+        self.openFor = openFor
+        self._openedAt = now
+        self.opened += 1
+        self._outcomes.clear()
+
+    def metrics(self):
+        self._trim(time.monotonic())
+        failures = sum(1 for _, ok in self._outcomes if not ok)
+        return {'state': self.state, 'requests': len(self._outcomes), 'failures': failures,
+                'opened': self.opened, 'rejected': self.rejected, 'openFor': self.openFor}
+
+
+class EndpointPolicies:
+    """
+    One policy object per endpoint, built on first use. `config` is True for
+    defaults everywhere, or a dict mapping endpoints to keyword arguments of
+    `cls` (None or False turns the policy off there); the '*' entry covers
+    endpoints not listed, and without it unlisted endpoints get no policy.
+    """
+
+    def __init__(self, cls, config):
+        self.cls = cls
+        self.config = {'*': {}} if config is True else dict(config)
+        self.policies = {}
+
+    def get(self, endpoint):
+        if endpoint not in self.policies:
+            options = self.config.get(endpoint, self.config.get('*'))
+            if options is None or options is False:
+                self.policies[endpoint] = None
+            else:
+                self.policies[endpoint] = self.cls(**({} if options is True else options))
+        return self.policies[endpoint]
+
+    def metrics(self):
+        return {endpoint: policy.metrics() for endpoint, policy in self.policies.items() if policy is not None}